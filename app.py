@@ -2,16 +2,21 @@ import streamlit as st
 import streamlit.components.v1 as components
 import google.generativeai as genai
 from PIL import Image
-from fpdf import FPDF
 import io
-import re
 import os
 import json
-import glob
-import unicodedata
-import tempfile
 import base64
+import tempfile
 from dotenv import load_dotenv
+import storage
+import call_policy
+import translation
+import history
+import pattern_book
+import yarn_estimate
+import image_index
+import pattern_document
+from pdf_export import create_pdf
 
 # Load environment variables
 load_dotenv()
@@ -29,270 +34,141 @@ try:
 except Exception:
     pass # Fail silently if secrets are missing or other errors occur
 
-# Create folder for saved patterns if it doesn't exist
+# Inventory lives in SAVE_DIR unless STORAGE_URL points at a shared backend
+# (e.g. "sqlite:///inventory.db" or "redis://host:6379/0") for multi-replica deployments
 SAVE_DIR = "inventory"
-if not os.path.exists(SAVE_DIR):
-    os.makedirs(SAVE_DIR)
-
-class PDF(FPDF):
-    def header(self):
-        if self.page_no() > 1: # No header on cover page
-            self.set_font('Arial', 'I', 10)
-            title = 'Ani-Gurumi AI - Crochet Pattern'
-            try:
-                title = title.encode('latin-1', 'replace').decode('latin-1')
-            except:
-                pass
-            self.cell(0, 10, title, 0, 1, 'R')
-            self.ln(5)
-
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
-
-    def cover_page(self, title, image_path=None):
-        self.add_page()
-        
-        # Logo (small at top)
-        if os.path.exists("logo.png"):
-            try:
-                # 30mm width, centered
-                x_pos = (210 - 30) / 2
-                self.image("logo.png", x=x_pos, y=10, w=30)
-            except:
-                pass
-
-        self.set_font('Arial', 'B', 24)
-        self.ln(30) # Move down (past logo)
-        
-        # Title
-        try:
-            safe_title = title.encode('latin-1', 'replace').decode('latin-1')
-        except:
-            safe_title = "Crochet Pattern"
-        self.cell(0, 10, safe_title, 0, 1, 'C')
-        self.ln(10)
-        
-        # Image
-        if image_path:
-            try:
-                # Center image (A4 width 210mm)
-                # Image width 70mm (smaller to fit tall images)
-                x_pos = (210 - 70) / 2
-                self.image(image_path, x=x_pos, w=70)
-            except:
-                pass
-        
-        self.ln(20)
-        self.set_font('Arial', '', 14)
-        self.cell(0, 10, "Created by Ani-Gurumi AI", 0, 1, 'C')
-        self.add_page() # New page for text
-
-def clean_text(text):
-    """Removes emojis and replaces difficult characters for FPDF (latin-1)."""
-    text = unicodedata.normalize('NFC', text)
-    text = text.replace('**', '')
-    text = text.replace('__', '')
-    replacements = {'”': '"', '“': '"', '’': "'", '–': '-', '—': '-'}
-    for k, v in replacements.items():
-        text = text.replace(k, v)
-    try:
-        text = text.encode('latin-1', 'replace').decode('latin-1')
-    except:
-        pass
-    return text
 
-def create_pdf(text, image_file, title="Crochet Pattern"):
-    pdf = PDF()
-    
-    # Handle image for cover page
-    tmp_filename = None
-    if image_file:
-        try:
-            img = Image.open(image_file)
-            if img.mode in ("RGBA", "P"): 
-                img = img.convert("RGB")
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-                img.save(tmp_file, format="JPEG")
-                tmp_filename = tmp_file.name
-        except:
-            pass
-
-    # Create cover page
-    pdf.cover_page(title, tmp_filename)
-    
-    pdf.set_auto_page_break(auto=True, margin=15)
-    
-    # Parse text
-    lines = text.split('\n')
-    for line in lines:
-        clean_line = clean_text(line).strip()
-        if not clean_line:
-            pdf.ln(5)
-            continue
-            
-        if line.startswith('#'):
-            level = len(line.split(' ')[0])
-            content = clean_text(line.lstrip('#').strip())
-            if level == 1:
-                pdf.set_font("Arial", 'B', 16)
-                pdf.ln(5)
-                pdf.cell(0, 10, content, 0, 1, 'L')
-                pdf.ln(2)
-            elif level == 2:
-                pdf.set_font("Arial", 'B', 14)
-                pdf.ln(4)
-                pdf.cell(0, 10, content, 0, 1, 'L')
-            else:
-                pdf.set_font("Arial", 'B', 12)
-                pdf.cell(0, 8, content, 0, 1, 'L')
-        elif line.strip().startswith('- ') or line.strip().startswith('* '):
-            pdf.set_font("Arial", '', 12)
-            pdf.set_x(15) 
-            pdf.multi_cell(0, 6, clean_line)
-            
-            # Check for round counter
-            counter_text = get_round_counter_text(clean_line)
-            if counter_text:
-                pdf.set_font("Courier", 'B', 12) # Monospace for alignment
-                pdf.set_x(20) # Indent
-                pdf.cell(0, 6, counter_text, 0, 1)
-                pdf.ln(2)
-
-        elif re.match(r'^\d+\.', line.strip()):
-            pdf.set_font("Arial", '', 12)
-            pdf.set_x(15)
-            pdf.multi_cell(0, 6, clean_line)
-            
-            # Check for round counter
-            counter_text = get_round_counter_text(clean_line)
-            if counter_text:
-                pdf.set_font("Courier", 'B', 12) # Monospace for alignment
-                pdf.set_x(20) # Indent
-                pdf.cell(0, 6, counter_text, 0, 1)
-                pdf.ln(2)
-        else:
-            pdf.set_font("Arial", '', 12)
-            pdf.multi_cell(0, 6, clean_line)
-            
-            # Check for round counter
-            counter_text = get_round_counter_text(clean_line)
-            if counter_text:
-                pdf.set_font("Courier", 'B', 12) # Monospace for alignment
-                pdf.set_x(20) # Indent
-                pdf.cell(0, 6, counter_text, 0, 1)
-                pdf.ln(2)
-
-    output = pdf.output(dest='S').encode('latin-1')
-    
-    # Clean up image
-    if tmp_filename:
-        try:
-            os.unlink(tmp_filename)
-        except:
-            pass
-            
-    return output
+def get_setting(name, default=None):
+    """Reads an optional setting from Streamlit secrets, then environment variables."""
+    try:
+        value = st.secrets.get(name)
+    except Exception:
+        value = None
+    return value or os.getenv(name) or default
+
+@st.cache_resource
+def get_storage():
+    """Returns the storage backend shared by inventory and caches (one per process)."""
+    return storage.get_backend(get_setting("STORAGE_URL"), SAVE_DIR)
+
+@st.cache_resource
+def get_image_index():
+    """Perceptual-hash index of inventory images, shared by all sessions of this process."""
+    return image_index.load_index(get_storage())
+
+# Upper bounds for one model request incl. retries/hedges (seconds)
+GENERATE_DEADLINE = 90
+EDIT_DEADLINE = 60
+
+@st.cache_resource
+def get_call_policy(operation):
+    """
+    Deadline/retry/hedging policy for one kind of Gemini call ("generate", "edit",
+    "translate"), shared by all sessions so its latency stats accumulate.
+    """
+    return call_policy.CallPolicy(name=operation)
 
 def save_pattern_to_disk(name, pattern_data, image_file):
     """Saves pattern (JSON) and image to inventory."""
-    # Create a safe filename
-    safe_name = "".join([c for c in name if c.isalpha() or c.isdigit() or c==' ']).strip().replace(" ", "_")
-    base_path = os.path.join(SAVE_DIR, safe_name)
-    
-    # Save JSON data
-    with open(f"{base_path}.json", "w", encoding="utf-8") as f:
-        json.dump(pattern_data, f, ensure_ascii=False, indent=2)
-        
-    # Save image (for PDF and display)
+    # Convert image to PNG bytes first (for PDF and display)
+    image_bytes = None
     if image_file:
         try:
+            img = None
             # If image_file is a string (path)
             if isinstance(image_file, str) and os.path.exists(image_file):
                  img = Image.open(image_file)
-                 img.save(f"{base_path}.png")
             # If image_file is an UploadedFile (from Streamlit)
             elif hasattr(image_file, 'seek'):
                 image_file.seek(0)
                 img = Image.open(image_file)
-                img.save(f"{base_path}.png")
+            if img is not None:
+                buf = io.BytesIO()
+                img.save(buf, format="PNG")
+                image_bytes = buf.getvalue()
         except Exception as e:
             print(f"Could not save image: {e}")
 
-def load_saved_patterns():
-    """Loads list of saved patterns from inventory."""
-    files = glob.glob(os.path.join(SAVE_DIR, "*.json"))
-    patterns = []
-    for f in files:
+    # Atomic, locked write (safe with several app processes/replicas)
+    # INVENTORY_FORMAT = "compact" stores new saves as compressed .agp instead of .json
+    key = storage.save_pattern(get_storage(), name, pattern_data, image_bytes, fmt=get_setting("INVENTORY_FORMAT", "json"))
+    if image_bytes:
+        # Keep the duplicate-image index up to date (one small entry per save)
         try:
-            with open(f, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                name = data.get("project_name", data.get("name", "Unnamed Project"))
-                patterns.append({"name": name, "path": f, "base_path": f.replace(".json", "")})
-        except:
-            pass
-    return patterns
-
-def pattern_json_to_markdown(data):
-    """Converts JSON pattern to Markdown text for PDF/Save."""
-    md = f"# {data.get('project_name', 'Crochet Pattern')}\n\n"
-    md += f"**Difficulty:** {data.get('difficulty', 'Unknown')}\n\n"
+            image_index.store_image(get_storage(), get_image_index(), key, image_bytes)
+        except Exception as e:
+            print(f"Could not index image: {e}")
+    return key
+
+def find_similar_projects(image_file):
+    """Inventory keys whose image is a near-duplicate of image_file, closest first. Cached per upload."""
+    cache_id = getattr(image_file, 'file_id', None) or getattr(image_file, 'name', None)
+    cached = st.session_state.get('similar_projects')
+    if cache_id and cached and cached[0] == cache_id:
+        return cached[1]
     
-    md += "**Materials:**\n"
-    for mat in data.get('materials', []):
-        md += f"- {mat}\n"
-    md += "\n"
+    try:
+        image_file.seek(0)
+        hashes = image_index.image_hashes(Image.open(image_file))
+        image_file.seek(0)
+        # Pick up projects saved by other app processes (lists the stored hashes every few seconds at most)
+        index = image_index.sync(get_storage(), get_image_index())
+        matches = [key for _, key in index.query(hashes)]
+    except Exception as e:
+        print(f"Could not search for similar images: {e}")
+        matches = []
+    st.session_state['similar_projects'] = (cache_id, matches)
+    return matches
+
+def load_project(key):
+    """Makes an inventory project the current pattern (with progress and image). Raises if it cannot be read."""
+    data, image_bytes = storage.load_pattern(get_storage(), key)
+    # New project -> fresh edit history (also creates markdown for PDF export)
+    set_pattern(data, "Loaded from inventory", new_history=True)
+    st.session_state['loaded_key'] = key
     
-    if data.get('hybrid_suggestion'):
-        md += "**Hybrid Mode Suggestion:**\n"
-        md += f"- Type: {data['hybrid_suggestion'].get('type')}\n"
-        md += f"- Description: {data['hybrid_suggestion'].get('description')}\n\n"
-        
-    md += "## Pattern\n"
-    for comp in data.get('components', []):
-        md += f"### {comp.get('name', 'Part')}\n"
-        for step in comp.get('steps', []):
-            md += f"- {step}\n"
-        md += "\n"
-        
-    return md
-
-def get_round_counter_text(step_text):
-    """
-    Parses step text for round ranges and returns a plain text string of numbers.
-    Returns None if no range found.
-    """
-    # Regex to find ranges like "Rnd 5-10", "Rnds 5-10", "Row 5-10", "R 5-10", "Varv 5-10", "R8-R14"
-    # Case insensitive, handles optional spaces, dots, plurals, different separators, and repeated prefixes
-    match = re.search(r'(?:Rnds?|Rows?|Rs?|Varv|Rounds?)\.?\s*(\d+)\s*(?:-|–|to)\s*(?:(?:Rnds?|Rows?|Rs?|Varv|Rounds?)\.?\s*)?(\d+)', step_text, re.IGNORECASE)
+    # Restore progress (checkboxes)
+    if 'progress' in data:
+        for progress_key, value in data['progress'].items():
+            st.session_state[progress_key] = value
     
-    if match:
-        try:
-            start = int(match.group(1))
-            end = int(match.group(2))
-            
-            # Only generate if it's a valid range and not too huge
-            if start < end and (end - start) < 50: 
-                numbers = []
-                count = 0
-                for i in range(start, end + 1):
-                    numbers.append(str(i))
-                    count += 1
-                    # Add separator every 5 numbers, but not at the very end
-                    if count % 5 == 0 and i != end:
-                        numbers.append("|")
-                
-                return " ".join(numbers)
-        except:
-            pass
-    return None
+    # Keep image bytes in session state (backend may not be a local disk)
+    if image_bytes:
+        st.session_state['loaded_image'] = image_bytes
+    else:
+         if 'loaded_image' in st.session_state:
+             del st.session_state['loaded_image']
+    return data
 
-def generate_round_counter(step_text):
+def load_saved_patterns():
+    """Loads list of saved patterns from inventory."""
+    try:
+        return storage.list_patterns(get_storage())
+    except Exception as e:
+        print(f"Could not list inventory: {e}")
+        return []
+
+def discard_pattern_book():
+    """Drops (and deletes) this session's built pattern book, e.g. once it has been downloaded."""
+    book = st.session_state.pop('pattern_book', None)
+    if book:
+        book.delete()
+
+def set_pattern(data, label, new_history=False):
+    """Makes data the current pattern and records it as a version in the session's edit history."""
+    if new_history or 'history' not in st.session_state:
+        st.session_state['history'] = history.PatternHistory()
+        # A new project: keep the inventory id of a loaded one, none for a fresh generation
+        st.session_state['project_id'] = data.get('project_id')
+    # The id is kept per session, not in the versions: edits come back from the model
+    # (which may drop unknown keys) and undo/redo rebuild the dict from history
+    data = {k: v for k, v in data.items() if k != 'project_id'}
+    st.session_state['pattern_data'] = st.session_state['history'].commit(data, label)
+
+def generate_round_counter(text):
     """
-    Returns formatted HTML string for the UI round counter.
+    Returns formatted HTML string for the UI round counter (text from a RoundCounter block).
     """
-    text = get_round_counter_text(step_text)
     if text:
         # Add extra spacing for HTML display
         formatted_str = text.replace(" ", "&nbsp;&nbsp;")
@@ -311,41 +187,82 @@ def generate_round_counter(step_text):
         """
     return None
 
-def render_interactive_pattern(data):
-    """Renders the pattern as an interactive Quest Log."""
-    st.markdown(f"## 🛡️ Quest: {data.get('project_name', 'Unknown Project')}")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        st.info(f"**Difficulty:** {data.get('difficulty', 'Unknown')}")
-    with col2:
-        st.warning(f"**Materials:** {', '.join(data.get('materials', []))}")
+def render_yarn_estimate(data):
+    """Size & yarn estimate, computed locally from the steps (no API call)."""
+    with st.expander("📏 Size & Yarn Estimate", expanded=False):
+        weights = list(yarn_estimate.YARN_WEIGHTS)
+        col_weight, col_hook = st.columns(2)
+        with col_weight:
+            yarn_weight = st.selectbox("Yarn weight:", weights, index=weights.index(yarn_estimate.DEFAULT_WEIGHT))
+        with col_hook:
+            min_hook, max_hook = 1.0, 15.0
+            default_hook = yarn_estimate.hook_from_materials(data.get('materials'))
+            # A size the widget can't hold (steel hooks, a misread "18 mm") would raise and stop the whole page
+            if not default_hook or not min_hook <= default_hook <= max_hook:
+                default_hook = yarn_estimate.YARN_WEIGHTS[yarn_weight][1]
+            hook_mm = st.number_input("Hook size (mm):", min_value=min_hook, max_value=max_hook, value=float(default_hook), step=0.25)
         
-    if data.get('hybrid_suggestion'):
-        with st.expander("🖨️ Hybrid Mode Suggestion", expanded=True):
-            st.write(f"**Part:** {data['hybrid_suggestion'].get('type')}")
-            st.write(f"**Info:** {data['hybrid_suggestion'].get('description')}")
-            
-            # Hybrid Link (Thingiverse)
-            search_term = data['hybrid_suggestion'].get('search_term')
-            if search_term:
-                url = f"https://www.thingiverse.com/search?q={search_term}&type=things&sort=relevant"
-                st.link_button("🔍 Find STL on Thingiverse", url)
+        estimate = yarn_estimate.estimate(data, yarn_weight, hook_mm)
+        # Kept for the PDF export
+        st.session_state['yarn_estimate'] = estimate
+        if estimate:
+            st.table([
+                {
+                    "Part": p['name'],
+                    "Rounds": p['rounds'],
+                    "Size (cm)": f"{p['width_cm']} × {p['height_cm']}",
+                    "Yarn (m)": p['yarn_m'],
+                }
+                for p in estimate['parts']
+            ])
+            st.write("**Yarn per colour:** " + ", ".join(f"{name} {metres} m" for name, metres in estimate['colours']))
+            st.caption(f"Total ≈ {estimate['total_m']} m incl. 15% for tails and sewing. Sizes are stuffed width × height.")
+        else:
+            st.caption("No rounds with stitch counts found in this pattern.")
+
+def render_interactive_pattern(data):
+    """Renders the pattern as an interactive Quest Log, from its (memoized) document model."""
+    document = pattern_document.build_document(data)
+    st.markdown(f"## 🛡️ Quest: {document.title}")
     
-    st.markdown("### 📜 Pattern (Quest Steps)")
+    if not any(isinstance(block, pattern_document.Summary) for block in document.blocks):
+        render_yarn_estimate(data)
     
-    # Loop through components (Head, Body, etc.)
-    for i, comp in enumerate(data.get('components', [])):
-        # Use expander for each part
-        with st.expander(f"🧶 {comp.get('name', 'Part')}", expanded=False):
-            # Checkboxes for each round
-            for j, step in enumerate(comp.get('steps', [])):
-                st.checkbox(step, key=f"step_{i}_{j}")
+    part_box = None
+    for block in document.blocks:
+        kind = type(block)
+        if kind is pattern_document.Summary:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.info(f"**Difficulty:** {block.difficulty}")
+            with col2:
+                st.warning(f"**Materials:** {', '.join(block.materials)}")
+            render_yarn_estimate(data)
+        
+        elif kind is pattern_document.Hybrid:
+            with st.expander("🖨️ Hybrid Mode Suggestion", expanded=True):
+                st.write(f"**Part:** {block.type}")
+                st.write(f"**Info:** {block.description}")
                 
-                # Round Counter Logic
-                counter_html = generate_round_counter(step)
-                if counter_html:
-                    st.markdown(counter_html, unsafe_allow_html=True)
+                # Hybrid Link (Thingiverse)
+                if block.search_term:
+                    url = f"https://www.thingiverse.com/search?q={block.search_term}&type=things&sort=relevant"
+                    st.link_button("🔍 Find STL on Thingiverse", url)
+        
+        elif kind is pattern_document.Heading:
+            st.markdown(f"### 📜 {block.text} (Quest Steps)" if block.level <= 2 else f"#### {block.text}")
+        
+        # Use expander for each part (Head, Body, etc.), checkboxes for each round
+        elif kind is pattern_document.Part:
+            part_box = st.expander(f"🧶 {block.name}", expanded=False)
+        elif kind is pattern_document.Step:
+            part_box.checkbox(block.text, key=f"step_{block.part}_{block.index}")
+        elif kind is pattern_document.ColourChange:
+            part_box.checkbox(f"🎨 {block.text}", key=f"step_{block.part}_{block.index}")
+        elif kind is pattern_document.RoundCounter:
+            part_box.markdown(generate_round_counter(block.text), unsafe_allow_html=True)
+        elif kind is pattern_document.Note:
+            (part_box or st).markdown(block.text)
     
     st.success("Don't forget to check off steps as you go! ✅")
 
@@ -576,41 +493,76 @@ def main():
     st.sidebar.markdown("### 📂 My Inventory")
     saved_patterns = load_saved_patterns()
     
+    # Options are the pattern dicts themselves, so projects sharing a name stay distinct
     selected_inventory_item = st.sidebar.selectbox(
         "Select Project:", 
-        ["-- Select --"] + [p["name"] for p in saved_patterns]
+        [None] + saved_patterns,
+        format_func=lambda p: "-- Select --" if p is None else f"{p['name']} ({p['key']})"
     )
     
     if st.sidebar.button("Load Project 📥"):
-        if selected_inventory_item != "-- Select --":
-            # Find correct file
-            pattern_info = next((p for p in saved_patterns if p["name"] == selected_inventory_item), None)
+        if selected_inventory_item is not None:
+            pattern_info = selected_inventory_item
             if pattern_info:
                 try:
-                    with open(pattern_info["path"], "r", encoding="utf-8") as f:
-                        data = json.load(f)
-                        st.session_state['pattern_data'] = data
-                        # Create markdown for PDF export
-                        st.session_state['generated_pattern'] = pattern_json_to_markdown(data)
-                        
-                        # Restore progress (checkboxes)
-                        if 'progress' in data:
-                            for key, value in data['progress'].items():
-                                st.session_state[key] = value
-                        
-                        # Load image to session state if it exists
-                        img_path = pattern_info["base_path"] + ".png"
-                        if os.path.exists(img_path):
-                            st.session_state['loaded_image_path'] = img_path
-                        else:
-                             if 'loaded_image_path' in st.session_state:
-                                 del st.session_state['loaded_image_path']
-                                 
-                    st.success(f"Loaded {selected_inventory_item}!")
+                    load_project(pattern_info["key"])
+                    st.success(f"Loaded {pattern_info['name']}!")
                     st.rerun()
                 except Exception as e:
                     st.sidebar.error(f"Could not load: {e}")
 
+    # Pattern Book (bulk export of many inventory projects)
+    with st.sidebar.expander("📚 Pattern Book"):
+        book_selection = st.multiselect(
+            "Projects (empty = whole inventory):",
+            saved_patterns,
+            format_func=lambda p: f"{p['name']} ({p['key']})"
+        )
+        book_format = st.radio("Format:", ["PDF book", "ZIP of PDFs"], horizontal=True)
+        
+        if st.button("Build Pattern Book 📚"):
+            book_keys = [p["key"] for p in (book_selection or saved_patterns)]
+            if not book_keys:
+                st.error("Your inventory is empty!")
+            else:
+                progress_bar = st.progress(0.0, text="Rendering patterns...")
+                
+                def report_progress(done, total, name):
+                    progress_bar.progress(done / total, text=f"{done}/{total}: {name}")
+                
+                suffix, mime = (".pdf", "application/pdf") if book_format == "PDF book" else (".zip", "application/zip")
+                book = None
+                book_file = None
+                try:
+                    # Written to disk as projects finish instead of being collected in memory
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as book_file:
+                        if suffix == ".pdf":
+                            pattern_book.export_book(get_storage(), book_keys, book_file, progress=report_progress)
+                        else:
+                            pattern_book.export_zip(get_storage(), book_keys, book_file, progress=report_progress)
+                    # Deleted when replaced below or when this session ends
+                    book = pattern_book.BookFile(book_file.name, f"Ani-gurumi Pattern Book{suffix}", mime)
+                except Exception as e:
+                    st.error(f"Pattern Book Error: {e}")
+                finally:
+                    if book is None and book_file is not None:
+                        # Failed or interrupted: remove the half-written file
+                        os.unlink(book_file.name)
+                
+                if book:
+                    # Replace (and delete) the previous book of this session
+                    discard_pattern_book()
+                    st.session_state['pattern_book'] = book
+        
+        book = st.session_state.get('pattern_book')
+        if book and os.path.exists(book.path):
+            # The book is only read into memory (and handed to the download button) on request,
+            # not on every rerun; after the download it is deleted
+            if st.button("Prepare download 📦"):
+                with open(book.path, "rb") as f:
+                    st.download_button("Download Pattern Book 📥", data=f.read(), file_name=book.name, mime=book.mime,
+                                       on_click=discard_pattern_book)
+
     # --- MAIN CONTENT ---
     
     # Custom CSS for nicer UI
@@ -708,10 +660,23 @@ def main():
         if uploaded_file:
             image = Image.open(uploaded_file)
             st.image(image, caption='Your selected character', use_container_width=True)
-        elif 'loaded_image_path' in st.session_state and os.path.exists(st.session_state['loaded_image_path']):
-            image = Image.open(st.session_state['loaded_image_path'])
+            
+            # Same (or nearly the same) image already in the inventory? Offer it before spending an API call
+            names = {p['key']: p['name'] for p in saved_patterns}
+            similar = [k for k in find_similar_projects(uploaded_file) if k in names and k != st.session_state.get('loaded_key')]
+            if similar:
+                st.info("🔁 This image looks like a project you already have in your inventory.")
+                for key in similar[:3]:
+                    if st.button(f"Load {names[key]} ({key}) 📂", key=f"similar_{key}"):
+                        try:
+                            load_project(key)
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Could not load: {e}")
+        elif 'loaded_image' in st.session_state:
+            image = Image.open(io.BytesIO(st.session_state['loaded_image']))
             st.image(image, caption='Loaded character', use_container_width=True)
-            uploaded_file = st.session_state['loaded_image_path'] # For PDF export
+            uploaded_file = io.BytesIO(st.session_state['loaded_image']) # For PDF export
 
     with col2:
         st.markdown("### 2. Configuration ⚙️")
@@ -798,20 +763,29 @@ def main():
                     if isinstance(uploaded_file, str):
                          img_to_send = Image.open(uploaded_file)
 
-                    response = model.generate_content([base_prompt, img_to_send])
+                    try:
+                        response = get_call_policy("generate").call(
+                            lambda timeout: model.generate_content([base_prompt, img_to_send], request_options={"timeout": timeout}),
+                            validate=lambda r: json.loads(r.text),
+                            deadline=GENERATE_DEADLINE,
+                        )
+                    except call_policy.InvalidResponse as e:
+                        # Every attempt returned broken JSON; fall through to the raw-text fallback
+                        response = e.result
                     
                     # Try parsing JSON
                     try:
                         pattern_data = json.loads(response.text)
-                        st.session_state['pattern_data'] = pattern_data
-                        # Convert to text for backward compatibility/saving
-                        st.session_state['generated_pattern'] = pattern_json_to_markdown(pattern_data)
+                        # New pattern -> fresh edit history
+                        set_pattern(pattern_data, "Generated", new_history=True)
                     except json.JSONDecodeError:
                         # Fallback if AI fails JSON
                         st.error("Could not parse AI response as JSON. Showing raw text.")
-                        st.session_state['generated_pattern'] = response.text
+                        st.markdown(response.text)
                         st.session_state['pattern_data'] = None
                     
+                except call_policy.DeadlineExceeded:
+                    st.error(f"⏱️ The AI did not answer within {GENERATE_DEADLINE} seconds. Please try again.")
                 except Exception as e:
                     st.error(f"Error: {e}")
                     if "429" in str(e):
@@ -829,6 +803,43 @@ def main():
         st.markdown("---")
         st.markdown("### ✍️ Edit Pattern")
         
+        # Undo/Redo (local edit history, no API call)
+        pattern_history = st.session_state.get('history')
+        if pattern_history and pattern_history.versions:
+            col_undo, col_redo, col_version = st.columns([1, 1, 4])
+            with col_undo:
+                if st.button("↩️ Undo", disabled=not pattern_history.can_undo(), use_container_width=True):
+                    st.session_state['pattern_data'] = pattern_history.undo()
+                    st.rerun()
+            with col_redo:
+                if st.button("↪️ Redo", disabled=not pattern_history.can_redo(), use_container_width=True):
+                    st.session_state['pattern_data'] = pattern_history.redo()
+                    st.rerun()
+            with col_version:
+                current_version = pattern_history.versions[pattern_history.position]
+                st.caption(f"Version {pattern_history.position + 1} of {len(pattern_history.versions)}: {current_version.label}")
+            
+            if len(pattern_history.versions) > 1:
+                with st.expander("🕘 History & Changes"):
+                    others = [i for i in range(len(pattern_history.versions)) if i != pattern_history.position]
+                    compare_to = st.selectbox(
+                        "Compare current version with:",
+                        others,
+                        index=len(others) - 1 if pattern_history.position == 0 else others.index(pattern_history.position - 1),
+                        format_func=lambda i: f"Version {i + 1}: {pattern_history.versions[i].label}"
+                    )
+                    changes = pattern_history.diff(compare_to, pattern_history.position)
+                    if not changes:
+                        st.write("No differences.")
+                    for kind, where, detail in changes:
+                        if kind == "field":
+                            st.markdown(f"**{where}:** {detail}")
+                        elif kind == "changed":
+                            st.markdown(f"**{where}** (changed)")
+                            st.code("\n".join(detail), language="diff")
+                        else:
+                            st.markdown(f"**{where}** ({kind}, {len(detail)} steps)")
+        
         edit_instruction = st.chat_input("Do you want to change something in the pattern? (e.g. 'Make the arms longer')")
         
         if edit_instruction:
@@ -864,18 +875,78 @@ def main():
                     - **COLORS:** Mention start colors and specific color names.
                     """
                     
-                    response = model.generate_content(edit_prompt)
+                    response = get_call_policy("edit").call(
+                        lambda timeout: model.generate_content(edit_prompt, request_options={"timeout": timeout}),
+                        validate=lambda r: json.loads(r.text),
+                        deadline=EDIT_DEADLINE,
+                    )
                     
                     new_pattern_data = json.loads(response.text)
-                    st.session_state['pattern_data'] = new_pattern_data
-                    st.session_state['generated_pattern'] = pattern_json_to_markdown(new_pattern_data)
+                    set_pattern(new_pattern_data, f"Edit: {edit_instruction}")
                     
                     st.success("Pattern updated!")
                     st.rerun()
                     
+                except call_policy.DeadlineExceeded:
+                    st.error(f"⏱️ Anigurobo did not answer within {EDIT_DEADLINE} seconds. Please try again.")
                 except Exception as e:
                     st.error(f"Failed to update pattern: {e}")
 
+        # --- TRANSLATION ---
+        st.markdown("### 🌐 Translate Pattern")
+        
+        col_lang, col_translate = st.columns([2, 1])
+        with col_lang:
+            target_language = st.selectbox(
+                "Language",
+                list(translation.LANGUAGES),
+                format_func=lambda code: translation.LANGUAGES[code],
+                label_visibility="collapsed"
+            )
+        with col_translate:
+            translate_btn = st.button("Translate 🌐", use_container_width=True)
+        
+        if 'translation_message' in st.session_state:
+            st.success(st.session_state.pop('translation_message'))
+        
+        if translate_btn:
+            with st.spinner("🧶 Anigurobo is translating the pattern..."):
+                try:
+                    genai.configure(api_key=api_key)
+                    model = genai.GenerativeModel(selected_model_name, generation_config={"response_mime_type": "application/json"})
+                    
+                    def translate_batch(texts, source, target):
+                        # Only strings that neither the rule table nor the translation memory know end up here
+                        prompt = translation.build_batch_prompt(texts, source, target)
+                        
+                        def validate(r):
+                            if len(json.loads(r.text)) != len(texts):
+                                raise ValueError("Translation count mismatch")
+                        
+                        response = get_call_policy("translate").call(
+                            lambda timeout: model.generate_content(prompt, request_options={"timeout": timeout}),
+                            validate=validate,
+                            deadline=EDIT_DEADLINE,
+                        )
+                        return json.loads(response.text)
+                    
+                    new_pattern_data, stats = translation.localize_pattern(
+                        st.session_state['pattern_data'], target_language, get_storage(), translate_batch
+                    )
+                    set_pattern(new_pattern_data, f"Translated to {translation.LANGUAGES[target_language]}")
+                    
+                    # Shown after the rerun
+                    st.session_state['translation_message'] = (
+                        f"Translated {stats['strings']} lines ({stats['unique']} unique): "
+                        f"{stats['rules']} by crochet rules, {stats['memory']} from memory, {stats['model']} by AI."
+                    )
+                    st.rerun()
+                    
+                except call_policy.DeadlineExceeded:
+                    st.error(f"⏱️ Anigurobo did not answer within {EDIT_DEADLINE} seconds. Please try again.")
+                except Exception as e:
+                    st.error(f"Failed to translate pattern: {e}")
+
         st.markdown("### 💾 Save & Export")
         
         col_save, col_pdf = st.columns(2)
@@ -886,33 +957,35 @@ def main():
                     # Update name in data if user changed it
                     st.session_state['pattern_data']['project_name'] = pattern_name_input
                     
-                    # Save progress (which boxes are checked)
+                    # Save progress (which boxes are checked), from the same blocks the checkboxes
+                    # come from, so legacy "text" patterns without components keep theirs too
                     progress_state = {}
-                    if 'pattern_data' in st.session_state:
-                        for i, comp in enumerate(st.session_state['pattern_data'].get('components', [])):
-                            for j, step in enumerate(comp.get('steps', [])):
-                                key = f"step_{i}_{j}"
-                                if key in st.session_state:
-                                    progress_state[key] = st.session_state[key]
+                    for block in pattern_document.build_document(st.session_state['pattern_data']).blocks:
+                        if isinstance(block, (pattern_document.Step, pattern_document.ColourChange)):
+                            key = f"step_{block.part}_{block.index}"
+                            if key in st.session_state:
+                                progress_state[key] = st.session_state[key]
                     st.session_state['pattern_data']['progress'] = progress_state
 
+                    # Same project id as earlier saves of this project -> overwrite instead of a suffixed copy
+                    if st.session_state.get('project_id'):
+                        st.session_state['pattern_data']['project_id'] = st.session_state['project_id']
                     save_pattern_to_disk(pattern_name_input, st.session_state['pattern_data'], uploaded_file)
+                    st.session_state['project_id'] = st.session_state['pattern_data']['project_id']
                     st.success("Saved to Inventory!")
                 else:
                     st.error("You must give the character a name!")
 
         with col_pdf:
             try:
-                # Ensure we have markdown for PDF
-                if 'generated_pattern' not in st.session_state:
-                     st.session_state['generated_pattern'] = pattern_json_to_markdown(st.session_state['pattern_data'])
-                
-                pdf_bytes = create_pdf(st.session_state['generated_pattern'], uploaded_file, title=pattern_name_input or "Crochet Pattern")
+                # Same (memoized) document model the quest log is rendered from
+                document = pattern_document.build_document(st.session_state['pattern_data'])
+                pdf_bytes = create_pdf(document, uploaded_file, title=pattern_name_input or "Crochet Pattern", estimate=st.session_state.get('yarn_estimate'))
                 
                 # Create filename
                 download_name = "ani-gurumi.pdf"
                 if pattern_name_input:
-                    clean_name = "".join([c for c in pattern_name_input if c.isalpha() or c.isdigit() or c==' ']).strip().replace(" ", "_")
+                    clean_name = storage.safe_filename(pattern_name_input)
                     if clean_name:
                         download_name = f"{clean_name} Ani-gurumi.pdf"
 
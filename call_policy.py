@@ -0,0 +1,208 @@
+import time
+import random
+import threading
+import collections
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+# HTTP-style status codes worth another try (google.api_core exceptions carry `.code`)
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when no good response arrived before the call's deadline."""
+
+
+class InvalidResponse(ValueError):
+    """A response that `validate` rejected. Keeps the response so callers can fall back to it."""
+
+    def __init__(self, result, cause):
+        super().__init__(f"Invalid response: {cause}")
+        self.result = result
+
+
+def is_retryable(exc):
+    """True for rate limits, transient server errors, timeouts and dropped connections."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, "code", None)
+    if callable(code):  # grpc-style exceptions expose code() instead
+        try:
+            code = code()
+        except Exception:
+            code = None
+    return code in RETRYABLE_CODES or "429" in str(exc)
+
+
+class CallStats:
+    """Thread-safe counters and a rolling window of successful attempt latencies."""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.counts = collections.Counter()
+
+    def record(self, event, latency=None):
+        with self._lock:
+            self.counts[event] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def quantile(self, q):
+        with self._lock:
+            values = sorted(self.latencies)
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def summary(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {**counts, "p50": self.quantile(0.50), "p95": self.quantile(0.95), "samples": len(self.latencies)}
+
+
+class CallPolicy:
+    """
+    Runs a model call with an overall deadline, jittered retries on retryable errors
+    and (optionally) a hedged duplicate request when an attempt is slower than the
+    recent p95. The first good response wins; losers are cancelled/ignored.
+
+    `attempt(timeout)` must make one request and should pass `timeout` (seconds left
+    until the deadline) on to the client so abandoned requests do not run forever.
+    `validate(result)` may raise to reject a response (e.g. unparseable JSON); that
+    counts as a retryable failure.
+
+    Latency stats (and so the hedge delay) are per policy: use one policy per kind
+    of call, since e.g. image generation and short text edits have very different
+    latencies and a shared p95 would hedge nearly every slow call.
+
+    Every attempt gets its own thread instead of a slot in a shared pool: abandoned
+    hedges and retries keep running until their own timeout, and with a fixed pool
+    new primaries would queue behind them and spend their deadline waiting.
+    """
+
+    def __init__(self, name="call", deadline=90.0, max_retries=2, backoff_base=0.5, backoff_max=8.0,
+                 hedge=True, hedge_quantile=0.95, hedge_min_samples=20, hedge_min_delay=1.0,
+                 max_hedges=1, retryable=is_retryable):
+        self.name = name
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.max_hedges = max_hedges
+        self.retryable = retryable
+        self.stats = CallStats()
+
+    def hedge_delay(self):
+        """Seconds to wait before sending a hedge, or None while there is too little data."""
+        if not self.hedge or len(self.stats.latencies) < self.hedge_min_samples:
+            return None
+        return max(self.hedge_min_delay, self.stats.quantile(self.hedge_quantile))
+
+    def _backoff(self, retry):
+        # "Full jitter": uniform in [0, min(max, base * 2^retry)]
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** retry)))
+
+    def _run_attempt(self, attempt, validate, timeout):
+        start = time.monotonic()
+        result = attempt(timeout)
+        if validate:
+            try:
+                validate(result)
+            except Exception as e:
+                raise InvalidResponse(result, e) from e
+        return result, time.monotonic() - start
+
+    def _start(self, attempt, validate, timeout):
+        """Runs one attempt on a new daemon thread; returns a Future for (result, latency)."""
+        fut = Future()
+        fut.set_running_or_notify_cancel()
+
+        def run():
+            try:
+                fut.set_result(self._run_attempt(attempt, validate, timeout))
+            except BaseException as e:
+                fut.set_exception(e)
+
+        threading.Thread(target=run, name="model-call", daemon=True).start()
+        return fut
+
+    def call(self, attempt, validate=None, deadline=None):
+        limit = deadline if deadline is not None else self.deadline
+        deadline_at = time.monotonic() + limit
+        self.stats.record("calls")
+        retries = 0
+        hedges = 0
+        pending = {}  # future -> "primary"/"hedge"
+        last_error = None
+
+        def remaining():
+            return deadline_at - time.monotonic()
+
+        def launch(kind):
+            fut = self._start(attempt, validate, max(remaining(), 0.001))
+            pending[fut] = kind
+            self.stats.record("attempts")
+
+        try:
+            launch("primary")
+            hedge_at = None
+            delay = self.hedge_delay()
+            if delay is not None:
+                hedge_at = time.monotonic() + delay
+
+            while pending:
+                if remaining() <= 0:
+                    self.stats.record("deadline_exceeded")
+                    raise DeadlineExceeded(f"No response within {limit:g}s") from last_error
+
+                timeout = remaining()
+                if hedge_at is not None and hedges < self.max_hedges:
+                    timeout = min(timeout, max(hedge_at - time.monotonic(), 0))
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                if not done:
+                    if hedge_at is not None and hedges < self.max_hedges and time.monotonic() >= hedge_at:
+                        # Slow attempt: fire a duplicate, keep the original running
+                        hedges += 1
+                        self.stats.record("hedges")
+                        launch("hedge")
+                    continue
+
+                for fut in done:
+                    kind = pending.pop(fut)
+                    try:
+                        result, latency = fut.result()
+                    except Exception as e:
+                        last_error = e
+                        self.stats.record("failures")
+                        continue
+                    self.stats.record("successes", latency)
+                    if kind == "hedge":
+                        self.stats.record("hedge_wins")
+                    return result
+
+                if pending:
+                    # Another attempt is still in flight; let it finish before retrying
+                    continue
+                retryable = isinstance(last_error, InvalidResponse) or self.retryable(last_error)
+                if retries >= self.max_retries or not retryable:
+                    raise last_error
+                pause = self._backoff(retries)
+                if pause >= remaining():
+                    self.stats.record("deadline_exceeded")
+                    raise DeadlineExceeded(f"No response within {limit:g}s") from last_error
+                time.sleep(pause)
+                retries += 1
+                self.stats.record("retries")
+                launch("primary")
+                delay = self.hedge_delay()
+                hedge_at = time.monotonic() + delay if delay is not None else None
+        finally:
+            # Attempts still running are abandoned: their own timeout ends the
+            # request and their result is dropped
+            for _ in pending:
+                self.stats.record("abandoned")
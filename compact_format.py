@@ -0,0 +1,218 @@
+"""
+Compact on-disk format for inventory patterns (".agp").
+
+Layout: b"AGP1" | encoding (1 byte) | compression (1 byte) | dictionary id (4 bytes) | body
+
+The body is [string_table, tree], where every string in pattern_data (keys
+included) is stored once in string_table and referenced by index in tree.
+It is encoded with msgpack when installed (JSON otherwise) and compressed with
+zstd when installed (zlib otherwise), optionally against a shared dictionary
+trained on the inventory, since most rounds ("sc in each st (42)") repeat
+across projects.
+
+Run `python compact_format.py <dir with .json patterns>` for a size/speed
+comparison against the current JSON files.
+"""
+import sys
+import json
+import zlib
+import struct
+import collections
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"AGP1"
+HEADER = struct.Struct(">4sBBI")
+
+ENC_JSON, ENC_MSGPACK = 0, 1
+COMP_NONE, COMP_ZLIB, COMP_ZSTD = 0, 1, 2
+
+# Tags for the interned tree. Strings are plain non-negative ints (table index);
+# everything else is a list starting with one of these.
+_DICT, _LIST, _SCALAR = -1, -2, -3
+
+DICTIONARY_SIZE = 32 * 1024  # zlib cannot use more than 32 KB anyway
+
+
+# --- INTERNING ---
+
+def _intern(value, table, index):
+    if isinstance(value, str):
+        if value not in index:
+            index[value] = len(table)
+            table.append(value)
+        return index[value]
+    if isinstance(value, dict):
+        node = [_DICT]
+        for k, v in value.items():
+            node.append(_intern(k, table, index))
+            node.append(_intern(v, table, index))
+        return node
+    if isinstance(value, (list, tuple)):
+        return [_LIST] + [_intern(v, table, index) for v in value]
+    return [_SCALAR, value]
+
+
+def _expand(node, table):
+    if isinstance(node, int) and not isinstance(node, bool):
+        return table[node]
+    tag = node[0]
+    if tag == _DICT:
+        return {table[node[i]]: _expand(node[i + 1], table) for i in range(1, len(node), 2)}
+    if tag == _LIST:
+        return [_expand(v, table) for v in node[1:]]
+    return node[1]
+
+
+# --- DICTIONARY ---
+
+def dictionary_id(dictionary):
+    return zlib.crc32(dictionary) if dictionary else 0
+
+
+def train_dictionary(patterns, size=DICTIONARY_SIZE):
+    """
+    Builds a shared compression dictionary from a list of pattern_data dicts.
+    Uses zstd's trainer when available and falls back to the most frequent
+    strings (most common last, where zlib finds them cheapest).
+    """
+    if zstandard is not None and len(patterns) >= 8:
+        samples = [_encode_body(p, ENC_MSGPACK if msgpack else ENC_JSON) for p in patterns]
+        try:
+            return zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            pass  # Too few/too small samples; use the frequency dictionary
+
+    counts = collections.Counter()
+    for p in patterns:
+        table = []
+        _intern(p, table, {})
+        counts.update(table)
+    chunks = []
+    total = 0
+    for text, n in counts.most_common():
+        if n < 2:
+            break
+        chunk = text.encode("utf-8")
+        if total + len(chunk) > size:
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(reversed(chunks))
+
+
+# --- ENCODE / DECODE ---
+
+def _encode_body(pattern_data, encoding):
+    table = []
+    tree = _intern(pattern_data, table, {})
+    if encoding == ENC_MSGPACK:
+        return msgpack.packb([table, tree], use_bin_type=True)
+    return json.dumps([table, tree], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode(pattern_data, dictionary=None):
+    """pattern_data -> .agp bytes."""
+    encoding = ENC_MSGPACK if msgpack else ENC_JSON
+    body = _encode_body(pattern_data, encoding)
+    if zstandard is not None:
+        compression = COMP_ZSTD
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        body = zstandard.ZstdCompressor(level=10, dict_data=dict_data).compress(body)
+    else:
+        compression = COMP_ZLIB
+        compressor = zlib.compressobj(9, zdict=dictionary) if dictionary else zlib.compressobj(9)
+        body = compressor.compress(body) + compressor.flush()
+    return HEADER.pack(MAGIC, encoding, compression, dictionary_id(dictionary)) + body
+
+
+def required_dictionary(data):
+    """Returns the dictionary id an .agp blob was written with (0 = none)."""
+    magic, _, _, dict_id = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an Ani-Gurumi compact pattern")
+    return dict_id
+
+
+def decode(data, dictionary=None):
+    """.agp bytes -> pattern_data. `dictionary` must match required_dictionary(data)."""
+    magic, encoding, compression, dict_id = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not an Ani-Gurumi compact pattern")
+    if dict_id and dictionary_id(dictionary) != dict_id:
+        raise ValueError(f"Pattern needs compression dictionary {dict_id:08x}")
+    body = data[HEADER.size:]
+
+    if compression == COMP_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("This pattern is zstd-compressed; install the 'zstandard' package")
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dict_id else None
+        body = zstandard.ZstdDecompressor(dict_data=dict_data).decompress(body)
+    elif compression == COMP_ZLIB:
+        decompressor = zlib.decompressobj(zdict=dictionary) if dict_id else zlib.decompressobj()
+        body = decompressor.decompress(body) + decompressor.flush()
+
+    if encoding == ENC_MSGPACK:
+        if msgpack is None:
+            raise RuntimeError("This pattern is msgpack-encoded; install the 'msgpack' package")
+        table, tree = msgpack.unpackb(body, raw=False, strict_map_key=False)
+    else:
+        table, tree = json.loads(body)
+    return _expand(tree, table)
+
+
+# --- BENCHMARK ---
+
+def _benchmark(directory, rounds=20):
+    import glob
+    import os
+    import time
+
+    paths = sorted(glob.glob(os.path.join(directory, "*.json")))
+    patterns = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            patterns.append(json.load(f))
+    if not patterns:
+        print(f"No .json patterns in {directory}")
+        return
+
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = fn()
+        return result, (time.perf_counter() - start) / rounds * 1000
+
+    dictionary = train_dictionary(patterns)
+    variants = [
+        ("json (current)",
+         lambda: [json.dumps(p, ensure_ascii=False, indent=2).encode("utf-8") for p in patterns],
+         lambda blobs: [json.loads(b) for b in blobs]),
+        ("agp",
+         lambda: [encode(p) for p in patterns],
+         lambda blobs: [decode(b) for b in blobs]),
+        ("agp + dictionary",
+         lambda: [encode(p, dictionary) for p in patterns],
+         lambda blobs: [decode(b, dictionary) for b in blobs]),
+    ]
+
+    print(f"{len(patterns)} patterns, msgpack={'yes' if msgpack else 'no'}, "
+          f"zstd={'yes' if zstandard else 'no'}, dictionary={len(dictionary)} bytes")
+    print(f"{'format':<18}{'bytes':>10}{'save ms':>10}{'load ms':>10}")
+    for name, save, load in variants:
+        blobs, save_ms = timed(save)
+        loaded, load_ms = timed(lambda: load(blobs))
+        assert loaded == patterns, f"{name} did not round-trip"
+        print(f"{name:<18}{sum(len(b) for b in blobs):>10}{save_ms:>10.2f}{load_ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    _benchmark(sys.argv[1] if len(sys.argv) > 1 else "inventory")
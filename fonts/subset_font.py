@@ -0,0 +1,117 @@
+"""
+Builds the bundled PDF font, fonts/NotoSansCJK-Subset.ttf, from Noto Sans CJK
+(SIL Open Font License 1.1, see OFL.txt).
+
+fpdf 1.7.2 only embeds TrueType (glyf) outlines, while Noto Sans CJK ships as
+CFF .otf, so the outlines are converted to quadratic curves after subsetting.
+The subset keeps what pattern names and steps need: Latin (incl. Swedish and
+romanized Japanese such as "Gojō"), Greek, Cyrillic, punctuation, kana, and the
+6,355 kanji of JIS X 0208 (levels 1 and 2, which covers nearly all Japanese
+names). Characters outside it are printed as "?" in the PDF.
+
+Needs fontTools (`pip install fonttools`), which the app itself does not:
+    python fonts/subset_font.py NotoSansCJKsc-Regular.otf
+"""
+import os
+import sys
+
+from fontTools import subset
+from fontTools.ttLib import TTFont, newTable
+from fontTools.pens.cu2quPen import Cu2QuPen
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NotoSansCJK-Subset.ttf")
+FAMILY = "Noto Sans CJK Subset"
+
+RANGES = [
+    (0x0020, 0x007E),  # ASCII
+    (0x00A0, 0x024F),  # Latin-1, Latin Extended-A/B
+    (0x0370, 0x03FF),  # Greek
+    (0x0400, 0x04FF),  # Cyrillic
+    (0x2000, 0x206F),  # General punctuation
+    (0x2100, 0x215F),  # Letterlike symbols, number forms
+    (0x2190, 0x21FF),  # Arrows
+    (0x2460, 0x24FF),  # Circled numbers
+    (0x25A0, 0x25FF),  # Geometric shapes
+    (0x3000, 0x30FF),  # CJK punctuation, hiragana, katakana
+    (0x31F0, 0x31FF),  # Katakana phonetic extensions
+    (0xFF00, 0xFFEF),  # Halfwidth and fullwidth forms
+]
+
+
+def _jis_x_0208_kanji():
+    """All kanji of JIS X 0208 (EUC-JP rows 16-84)."""
+    kanji = set()
+    for row in range(16, 85):
+        for cell in range(1, 95):
+            try:
+                kanji.add(ord(bytes([0xA0 + row, 0xA0 + cell]).decode("euc_jp")))
+            except UnicodeDecodeError:
+                pass
+    return kanji
+
+
+def _cff_to_glyf(font):
+    """Replaces the CFF table with TrueType outlines (max error 1 unit)."""
+    glyph_order = font.getGlyphOrder()
+    glyph_set = font.getGlyphSet()
+    glyf = newTable("glyf")
+    glyf.glyphOrder = glyph_order
+    glyf.glyphs = {}
+    for name in glyph_order:
+        pen = TTGlyphPen(glyph_set)
+        glyph_set[name].draw(Cu2QuPen(pen, max_err=1.0, reverse_direction=True))
+        glyf.glyphs[name] = pen.glyph()
+    for name in glyph_order:
+        glyf.glyphs[name].recalcBounds(glyf)
+    del font["CFF "]
+    if "VORG" in font:
+        del font["VORG"]
+    font["glyf"] = glyf
+    font["loca"] = newTable("loca")
+    maxp = font["maxp"]
+    maxp.tableVersion = 0x00010000
+    # Point/contour maxima are recalculated from glyf when the font is saved
+    for field in ("maxPoints", "maxContours", "maxCompositePoints", "maxCompositeContours", "maxComponentDepth",
+                  "maxZones", "maxTwilightPoints", "maxStorage", "maxFunctionDefs", "maxInstructionDefs",
+                  "maxStackElements", "maxSizeOfInstructions", "maxComponentElements"):
+        setattr(maxp, field, 0)
+    maxp.maxZones = 1
+    font["head"].glyphDataFormat = 0
+    font["post"].formatType = 3.0  # no glyph names needed
+    font.sfntVersion = "\x00\x01\x00\x00"
+
+
+def _rename(font):
+    for record in font["name"].names:
+        if record.nameID in (1, 4, 16):
+            record.string = FAMILY
+        elif record.nameID == 6:
+            record.string = FAMILY.replace(" ", "")
+        elif record.nameID == 3:
+            record.string = f"{FAMILY.replace(' ', '')};subset"
+
+
+def main(source):
+    codepoints = _jis_x_0208_kanji()
+    for first, last in RANGES:
+        codepoints.update(range(first, last + 1))
+
+    options = subset.Options()
+    options.layout_features = []  # fpdf does no shaping
+    options.hinting = False
+    options.name_IDs = [0, 1, 2, 3, 4, 5, 6, 13, 14]
+    options.notdef_outline = True
+    font = subset.load_font(source, options)
+    subsetter = subset.Subsetter(options)
+    subsetter.populate(unicodes=codepoints)
+    subsetter.subset(font)
+
+    _cff_to_glyf(font)
+    _rename(font)
+    font.save(OUTPUT)
+    print(f"{OUTPUT}: {len(font.getGlyphOrder())} glyphs, {os.path.getsize(OUTPUT) / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import shutil
+import difflib
+import weakref
+import tempfile
+
+
+def _fingerprint(value):
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+class Version:
+    """One snapshot of pattern_data. Components are shared with other versions when unchanged."""
+
+    def __init__(self, label, keys, meta, components):
+        self.label = label
+        self.created = time.time()
+        self.keys = keys              # top-level key order of the original dict
+        self.meta = meta              # everything except "components"
+        self.components = components  # tuple of component dicts (treat as read-only), or None
+        self.spill_path = None        # set when the version has been moved to disk
+
+    @property
+    def in_memory(self):
+        return self.spill_path is None
+
+
+class PatternHistory:
+    """
+    Versioned edit history for one pattern with instant undo/redo and diffs.
+
+    commit() stores only what changed: components (and the metadata dict) that
+    are equal to the current version's are reused by reference instead of
+    copied, so each version costs memory proportional to the edit. At most
+    `max_in_memory` versions are kept in RAM; older ones are spilled to a
+    temporary directory as JSON and read back on demand.
+
+    Returned pattern dicts are fresh top-level dicts, but their components may
+    be shared with other versions and must not be mutated in place.
+    """
+
+    def __init__(self, max_versions=100, max_in_memory=20):
+        self.max_versions = max_versions
+        self.max_in_memory = max_in_memory
+        self.versions = []
+        self.position = -1
+        self._spill_dir = None
+
+    # --- recording ---
+
+    def commit(self, pattern_data, label):
+        """Records pattern_data as the newest version (dropping any redo branch) and returns it."""
+        base = self._load(self.versions[self.position]) if self.position >= 0 else None
+        shared = {}
+        if base is not None:
+            shared = {_fingerprint(c): c for c in base.components}
+
+        components = []
+        for comp in pattern_data.get("components", []):
+            fp = _fingerprint(comp)
+            if fp not in shared:
+                # New or changed: keep a private copy so later caller mutations cannot leak in
+                shared[fp] = json.loads(fp)
+            components.append(shared[fp])
+
+        meta = {k: v for k, v in pattern_data.items() if k != "components"}
+        if base is not None and _fingerprint(base.meta) == _fingerprint(meta):
+            meta = base.meta
+        else:
+            meta = json.loads(_fingerprint(meta))
+
+        version = Version(label, tuple(pattern_data.keys()), meta, tuple(components))
+        del self.versions[self.position + 1:]
+        self.versions.append(version)
+        if len(self.versions) > self.max_versions:
+            dropped = self.versions.pop(0)
+            if dropped.spill_path:
+                os.unlink(dropped.spill_path)
+        self.position = len(self.versions) - 1
+        self._spill_old()
+        return self.current()
+
+    # --- navigation ---
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.versions) - 1
+
+    def undo(self):
+        if self.can_undo():
+            self.position -= 1
+        return self.current()
+
+    def redo(self):
+        if self.can_redo():
+            self.position += 1
+        return self.current()
+
+    def current(self):
+        if self.position < 0:
+            return None
+        return self.materialize(self.position)
+
+    def materialize(self, index):
+        """Returns version `index` as a pattern_data dict."""
+        version = self._load(self.versions[index])
+        data = {}
+        for key in version.keys:
+            data[key] = list(version.components) if key == "components" else version.meta[key]
+        return data
+
+    # --- diff ---
+
+    def diff(self, old_index, new_index):
+        """
+        Lists changes between two versions as (kind, where, detail) tuples, where kind is
+        "field", "added", "removed" or "changed" (detail = unified diff lines of the steps).
+        Components shared by reference are skipped without comparing their steps.
+        """
+        old, new = self._load(self.versions[old_index]), self._load(self.versions[new_index])
+        changes = []
+
+        if old.meta is not new.meta:
+            for key in dict.fromkeys(list(old.meta) + list(new.meta)):
+                if old.meta.get(key) != new.meta.get(key):
+                    changes.append(("field", key, f"{old.meta.get(key)!r} → {new.meta.get(key)!r}"))
+
+        old_by_name = {c.get("name", f"Part {i + 1}"): c for i, c in enumerate(old.components)}
+        new_by_name = {c.get("name", f"Part {i + 1}"): c for i, c in enumerate(new.components)}
+        for name, comp in new_by_name.items():
+            before = old_by_name.get(name)
+            if before is None:
+                changes.append(("added", name, comp.get("steps", [])))
+            elif before is not comp and before != comp:
+                lines = list(difflib.unified_diff(before.get("steps", []), comp.get("steps", []), lineterm="", n=1))[2:]
+                changes.append(("changed", name, lines))
+        for name, comp in old_by_name.items():
+            if name not in new_by_name:
+                changes.append(("removed", name, comp.get("steps", [])))
+        return changes
+
+    # --- memory bound ---
+
+    def _spill_old(self):
+        """Moves the oldest in-memory versions to disk, never the current one."""
+        in_memory = [i for i, v in enumerate(self.versions) if v.in_memory]
+        excess = len(in_memory) - self.max_in_memory
+        for i in in_memory:
+            if excess <= 0:
+                break
+            if i == self.position:
+                continue
+            version = self.versions[i]
+            if self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="anigurumi-history-")
+                weakref.finalize(self, shutil.rmtree, self._spill_dir, ignore_errors=True)
+            path = os.path.join(self._spill_dir, f"{id(version)}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"meta": version.meta, "components": version.components}, f, ensure_ascii=False)
+            version.spill_path = path
+            version.meta = version.components = None
+            excess -= 1
+
+    def _load(self, version):
+        """Returns an in-memory view of version (reads spilled versions back without keeping them)."""
+        if version.in_memory:
+            return version
+        with open(version.spill_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        loaded = Version(version.label, version.keys, stored["meta"], tuple(stored["components"]))
+        loaded.created = version.created
+        return loaded
@@ -0,0 +1,193 @@
+"""
+Near-duplicate detection for inventory images.
+
+Every inventory image gets three 64-bit perceptual hashes (aHash, dHash and
+pHash), stored next to the project as "image_hashes/<key>" so the index can be
+rebuilt from any storage backend and grows one entry per save.
+
+Lookups use multi-index hashing on the pHash: the 64 bits are split into four
+16-bit chunks, each with its own hash table. Two hashes within distance r agree
+to within r // 4 bits on at least one chunk, so a query only probes the few
+chunk values that close to its own and verifies that small candidate set,
+instead of comparing against every image. Candidates must also be close on
+aHash and dHash, which rules out pHash collisions between unrelated images.
+
+Re-encodes, resizes and centred crops (up to about 10%) are found. Crops from
+one side shift the whole picture: a few percent still match, but from about 5%
+the pHash is often further away than MAX_DISTANCE.
+"""
+import io
+import time
+import struct
+import threading
+
+import numpy as np
+from PIL import Image
+
+HASH_PREFIX = "image_hashes/"
+HASHES = struct.Struct(">QQQ")  # aHash, dHash, pHash
+
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+MAX_DISTANCE = 10  # pHash bits; re-encodes/resizes stay near 0, centred 10% crops around 8
+SYNC_INTERVAL = 10  # seconds between listings of the stored hashes (see sync)
+
+_DCT_SIZE = 32
+_n = np.arange(_DCT_SIZE)
+_DCT = np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / (2 * _DCT_SIZE))
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _gray(image, size):
+    return np.asarray(image.convert("L").resize(size, Image.LANCZOS), dtype=np.float64)
+
+
+def image_hashes(image):
+    """PIL image or encoded image bytes -> (aHash, dHash, pHash) as 64-bit ints."""
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    if image.mode in ("RGBA", "LA", "P"):
+        # Transparent areas count as white, like they look in the app
+        background = Image.new("RGBA", image.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, image.convert("RGBA"))
+
+    small = _gray(image, (8, 8))
+    a_hash = _bits_to_int(small > small.mean())
+
+    wide = _gray(image, (9, 8))
+    d_hash = _bits_to_int(wide[:, 1:] > wide[:, :-1])
+
+    # 2-D DCT-II of a 32x32 thumbnail; the top-left 8x8 are the lowest frequencies
+    low = (_DCT @ _gray(image, (_DCT_SIZE, _DCT_SIZE)) @ _DCT.T)[:8, :8].ravel()
+    p_hash = _bits_to_int(low > np.median(low[1:]))
+    return a_hash, d_hash, p_hash
+
+
+def _chunk_masks(radius):
+    """All CHUNK_BITS-bit masks with at most `radius` bits set."""
+    masks = {0}
+    for _ in range(radius):
+        masks |= {m | (1 << b) for m in masks for b in range(CHUNK_BITS)}
+    return list(masks)
+
+
+class ImageIndex:
+    """
+    In-memory multi-index over (aHash, dHash, pHash) tuples keyed by inventory key.
+    Thread-safe: one index is shared by all sessions of a process.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.synced_at = 0.0
+        self._tables = [{} for _ in range(CHUNKS)]
+        self._masks = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, key):
+        return key in self.hashes
+
+    @staticmethod
+    def _chunks(p_hash):
+        mask = (1 << CHUNK_BITS) - 1
+        return [(p_hash >> (i * CHUNK_BITS)) & mask for i in range(CHUNKS)]
+
+    def add(self, key, hashes):
+        with self._lock:
+            if key in self.hashes:
+                self.remove(key)
+            self.hashes[key] = hashes
+            for table, chunk in zip(self._tables, self._chunks(hashes[2])):
+                table.setdefault(chunk, set()).add(key)
+
+    def remove(self, key):
+        with self._lock:
+            hashes = self.hashes.pop(key, None)
+            if hashes is None:
+                return
+            for table, chunk in zip(self._tables, self._chunks(hashes[2])):
+                bucket = table.get(chunk)
+                if bucket:
+                    bucket.discard(key)
+                    if not bucket:
+                        del table[chunk]
+
+    def query(self, hashes, max_distance=MAX_DISTANCE):
+        """Returns [(distance, key)] of near-duplicates, closest first. distance is the pHash distance."""
+        radius = max_distance // CHUNKS
+        if radius not in self._masks:
+            self._masks[radius] = _chunk_masks(radius)
+        masks = self._masks[radius]
+
+        with self._lock:
+            candidates = set()
+            for table, chunk in zip(self._tables, self._chunks(hashes[2])):
+                for mask in masks:
+                    bucket = table.get(chunk ^ mask)
+                    if bucket:
+                        candidates.update(bucket)
+            others = [(key, self.hashes[key]) for key in candidates]
+
+        a_hash, d_hash, p_hash = hashes
+        matches = []
+        for key, other in others:
+            distance = (p_hash ^ other[2]).bit_count()
+            if distance > max_distance:
+                continue
+            # Confirm on the other two hashes (looser: they are less robust to crops)
+            if (a_hash ^ other[0]).bit_count() + (d_hash ^ other[1]).bit_count() > 3 * max_distance:
+                continue
+            matches.append((distance, key))
+        return sorted(matches)
+
+
+# --- PERSISTENCE ---
+
+def store_image(backend, index, key, image_bytes):
+    """Hashes a just-saved inventory image and adds it to the stored and in-memory index."""
+    hashes = image_hashes(image_bytes)
+    backend.put(HASH_PREFIX + key, HASHES.pack(*hashes))
+    index.add(key, hashes)
+    return hashes
+
+
+def sync(backend, index, max_age=SYNC_INTERVAL):
+    """
+    Adds entries other processes stored since the last sync. Only lists the small
+    hash entries, and at most once every max_age seconds (saves in this process
+    go straight into the index through store_image).
+    """
+    now = time.monotonic()
+    if now - index.synced_at < max_age:
+        return index
+    index.synced_at = now
+    stored = [k for k in backend.keys(HASH_PREFIX) if k[len(HASH_PREFIX):] not in index]
+    for full_key, raw in zip(stored, backend.get_many(stored)):
+        if raw is not None and len(raw) == HASHES.size:
+            index.add(full_key[len(HASH_PREFIX):], HASHES.unpack(raw))
+    return index
+
+
+def _hash_unindexed_images(backend, index):
+    """Hashes inventory images that have no entry yet (projects saved before the index existed)."""
+    images = [k for k in backend.keys(recursive=False) if k.endswith(".png") and k[:-4] not in index]
+    for full_key, raw in zip(images, backend.get_many(images)):
+        if raw is None:
+            continue
+        try:
+            store_image(backend, index, full_key[:-4], raw)
+        except (OSError, ValueError):
+            pass  # Unreadable image; skip it
+
+
+def load_index(backend):
+    """Builds the index from the stored hashes; the whole inventory is only listed here, once."""
+    index = sync(backend, ImageIndex(), max_age=0)
+    _hash_unindexed_images(backend, index)
+    return index
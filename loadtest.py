@@ -0,0 +1,339 @@
+"""
+Load-test harness for Ani-Gurumi AI.
+
+Drives the real app.py with Streamlit's AppTest, one simulated session per
+thread (the same threading model as a single `streamlit run` server process),
+with Gemini replaced by a local stub of configurable latency.
+
+Each session does: open app -> upload image -> generate -> check steps ->
+chat edit -> save to inventory -> download PDF, and every rerun is timed.
+
+Usage:
+    python loadtest.py --sessions 50 --latency 2.0 --jitter 0.5
+"""
+import os
+import io
+import sys
+import ast
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import statistics
+
+from PIL import Image
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+STUB_PATTERN = {
+    "project_name": "Load Test Character",
+    "difficulty": "Medium",
+    "materials": ["Skin Color yarn", "Black yarn", "3.5 mm hook", "Safety eyes"],
+    "hybrid_suggestion": None,
+    "components": [
+        {
+            "name": "Head (Worked top-down. MR is the top)",
+            "steps": [
+                "Start with SKIN COLOR yarn.",
+                "R1: 6 sc in MR (6)",
+                "R2: inc in each st (12)",
+                "R3: (sc, inc) x 6 (18)",
+                "R4: (2 sc, inc) x 6 (24)",
+                "R5-R12: sc in each st (24)",
+                "R13: (2 sc, dec) x 6 (18)",
+                "R14: (sc, dec) x 6 (12)",
+                "R15: dec x 6 (6)",
+            ],
+        },
+        {
+            "name": "Body (Worked bottom-up)",
+            "steps": [
+                "Start with BLACK yarn.",
+                "R1: 6 sc in MR (6)",
+                "R2: inc in each st (12)",
+                "R3-R10: sc in each st (12)",
+                "Leave a long tail for sewing.",
+            ],
+        },
+    ],
+}
+
+
+# --- GEMINI STUB ---
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubUnavailable(Exception):
+    """Looks like a 503 from the API to the app's retry policy."""
+    code = 503
+
+
+class StubModel:
+    """
+    Stands in for genai.GenerativeModel: sleeps, then returns a canned JSON pattern.
+    A fraction of calls can fail with a 503 or take `slow_latency` instead.
+    """
+    latency = 1.0
+    jitter = 0.0
+    fail_rate = 0.0
+    slow_rate = 0.0
+    slow_latency = 10.0
+    calls = 0
+    _lock = threading.Lock()
+
+    def __init__(self, model_name=None, generation_config=None, **kwargs):
+        pass
+
+    def generate_content(self, contents, **kwargs):
+        with StubModel._lock:
+            StubModel.calls += 1
+        if random.random() < StubModel.fail_rate:
+            time.sleep(StubModel.latency / 10)
+            raise StubUnavailable("503 Service Unavailable (stub)")
+        if random.random() < StubModel.slow_rate:
+            time.sleep(StubModel.slow_latency)
+        else:
+            time.sleep(max(0.0, random.gauss(StubModel.latency, StubModel.jitter)))
+        pattern = json.loads(json.dumps(STUB_PATTERN))
+        if isinstance(contents, str):
+            # Edit request: pretend the model changed something
+            pattern["components"][1]["steps"].insert(-1, "R11-R14: sc in each st (12)")
+        return StubResponse(json.dumps(pattern))
+
+
+def install_stub(latency, jitter, fail_rate=0.0, slow_rate=0.0, slow_latency=10.0):
+    import google.generativeai as genai
+    StubModel.latency = latency
+    StubModel.jitter = jitter
+    StubModel.fail_rate = fail_rate
+    StubModel.slow_rate = slow_rate
+    StubModel.slow_latency = slow_latency
+    genai.GenerativeModel = StubModel
+    genai.configure = lambda **kwargs: None
+
+
+def track_call_policies():
+    """Returns a list that collects every CallPolicy the app creates (for its counters in the report)."""
+    import call_policy
+    policies = []
+    original = call_policy.CallPolicy.__init__
+
+    def init(self, *args, **kwargs):
+        original(self, *args, **kwargs)
+        policies.append(self)
+
+    call_policy.CallPolicy.__init__ = init
+    return policies
+
+
+def install_runtime_shim():
+    """
+    AppTest swaps a mock Runtime into a process-wide singleton for each run and
+    resets it to None afterwards, which breaks other sessions running at the same
+    time. Keep serving the last mock runtime while the slot is empty. The other
+    process-wide state AppTest touches per run is made safe below.
+    """
+    from streamlit.runtime import Runtime
+    original = Runtime.instance
+    last = [None]
+
+    def instance(cls):
+        if cls._instance is not None:
+            last[0] = cls._instance
+            return cls._instance
+        if last[0] is not None:
+            return last[0]
+        return original()
+
+    Runtime.instance = classmethod(instance)
+
+    # Each AppTest compiles app.py itself, and CPython 3.11's ast.parse is not safe to run
+    # from several threads at once ("AST constructor recursion depth mismatch")
+    parse = ast.parse
+    parse_lock = threading.Lock()
+
+    def locked_parse(*args, **kwargs):
+        with parse_lock:
+            return parse(*args, **kwargs)
+
+    ast.parse = locked_parse
+
+    # Each run also patches config.get_option to report "global.appTest" and restores the
+    # function it found on exit. Overlapping runs restore out of order, so one session's
+    # script can run with the real get_option and skip recording button values for the
+    # test (later a KeyError '$$ID-...-None' in AppTest). Set the option itself instead.
+    from streamlit import config
+    config.set_option("global.appTest", True)
+
+
+# --- SESSION ---
+
+def make_test_image():
+    buf = io.BytesIO()
+    Image.new("RGB", (512, 512), (230, 180, 150)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def find_button(at, prefix):
+    return next(b for b in at.button if b.label.startswith(prefix))
+
+
+class Session:
+    """One simulated user. Records (step, seconds) for every rerun."""
+
+    def __init__(self, index, image_bytes, timeout):
+        self.index = index
+        self.image_bytes = image_bytes
+        self.timeout = timeout
+        self.timings = []
+        self.step = None
+        self.error = None
+        self.at = None
+
+    def _timed(self, step, action):
+        """Runs action (finding the widget and rerunning), timed and recorded under step."""
+        self.step = step
+        start = time.perf_counter()
+        action()
+        self.timings.append((step, time.perf_counter() - start))
+        if self.at.exception:
+            raise RuntimeError(self.at.exception[0].message)
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+        try:
+            self.step = "open"
+            self.at = at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+            self._timed("open", at.run)
+
+            if hasattr(at.file_uploader[0], "set_value"):
+                self._timed("upload", lambda: at.file_uploader[0].set_value(("character.png", self.image_bytes, "image/png")).run())
+            else:
+                # Older AppTest cannot drive st.file_uploader; inject the image the
+                # same way an inventory load does
+                at.session_state["loaded_image"] = self.image_bytes
+                self._timed("upload", at.run)
+
+            self._timed("generate", lambda: find_button(at, "Generate Pattern").click().run())
+
+            for key in ("step_0_0", "step_0_1", "step_1_0"):
+                self._timed("check", lambda: at.checkbox(key=key).check().run())
+
+            self._timed("edit", lambda: at.chat_input[0].set_value("Make the body longer").run())
+
+            self.step = "save"
+            at.text_input[0].set_value(f"Load Test {self.index}")
+            self._timed("save", lambda: find_button(at, "Save to Inventory").click().run())
+
+            # The PDF itself is built on every rerun; this is the click on top
+            self._timed("download_pdf", lambda: at.download_button[0].click().run())
+        except Exception as e:
+            self.error = f"{self.step}: {type(e).__name__}: {e}"
+
+
+# --- REPORT ---
+
+def rss_mb():
+    """Resident set size of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def report(sessions, wall, rss_before, rss_after, stub_latency, policies=()):
+    ok = [s for s in sessions if not s.error]
+    by_step = {}
+    for s in ok:
+        for step, seconds in s.timings:
+            by_step.setdefault(step, []).append(seconds)
+
+    print(f"\nSessions: {len(sessions)} ({len(sessions) - len(ok)} failed), wall time {wall:.1f}s")
+    print(f"Stub model latency: {stub_latency:.2f}s, model calls: {StubModel.calls}")
+    print(f"\n{'step':<14}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    all_times = []
+    for step, times in by_step.items():
+        all_times.extend(times)
+        print(f"{step:<14}{len(times):>6}"
+              f"{percentile(times, 50) * 1000:>10.0f}{percentile(times, 95) * 1000:>10.0f}"
+              f"{percentile(times, 99) * 1000:>10.0f}{max(times) * 1000:>10.0f}")
+    if all_times:
+        print(f"{'all reruns':<14}{len(all_times):>6}"
+              f"{percentile(all_times, 50) * 1000:>10.0f}{percentile(all_times, 95) * 1000:>10.0f}"
+              f"{percentile(all_times, 99) * 1000:>10.0f}{max(all_times) * 1000:>10.0f}")
+        print(f"\nThroughput: {len(all_times) / wall:.1f} reruns/s, {len(ok) / wall:.2f} completed sessions/s")
+        print(f"Mean rerun time excluding model calls: "
+              f"{statistics.mean(t for s in ok for step, t in s.timings if step not in ('generate', 'edit')) * 1000:.0f} ms")
+    print(f"Memory: {rss_before:.0f} MB -> {rss_after:.0f} MB RSS, "
+          f"~{(rss_after - rss_before) / max(len(sessions), 1):.1f} MB per live session")
+    for policy in policies:
+        # Retries, hedges and abandoned attempts per call policy of the app (one per operation), attempt latency in s
+        summary = policy.stats.summary()
+        print(f"Call policy {policy.name}: " + ", ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}"
+                                          for k, v in summary.items()))
+    for s in sessions:
+        if s.error:
+            print(f"  session {s.index} failed: {s.error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py")
+    parser.add_argument("--sessions", type=int, default=20, help="number of concurrent sessions")
+    parser.add_argument("--latency", type=float, default=1.0, help="mean stub model latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.2, help="stddev of stub model latency (s)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of model calls failing with 503")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="fraction of model calls taking --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=10.0, help="latency of slow model calls (s)")
+    parser.add_argument("--ramp", type=float, default=0.0, help="spread session starts over this many seconds")
+    parser.add_argument("--timeout", type=float, default=120.0, help="per-rerun timeout (s)")
+    args = parser.parse_args()
+
+    # Run from the app directory (it loads logo/banner by relative path) against a
+    # throwaway inventory, with a dummy key so the app gets past the API-key check
+    os.chdir(os.path.dirname(APP_PATH))
+    os.environ["STORAGE_URL"] = "file://" + tempfile.mkdtemp(prefix="anigurumi-loadtest-")
+    os.environ.setdefault("GOOGLE_API_KEY", "stub")
+    install_stub(args.latency, args.jitter, args.fail_rate, args.slow_rate, args.slow_latency)
+    install_runtime_shim()
+    policies = track_call_policies()
+
+    image_bytes = make_test_image()
+    sessions = [Session(i, image_bytes, args.timeout) for i in range(args.sessions)]
+    threads = [threading.Thread(target=s.run, name=f"session-{s.index}") for s in sessions]
+
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+        if args.ramp:
+            time.sleep(args.ramp / len(threads))
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    # Sessions (and their AppTest trees) are still referenced here
+    rss_after = rss_mb()
+
+    report(sessions, wall, rss_before, rss_after, args.latency, policies)
+    return 1 if any(s.error for s in sessions) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Bulk "pattern book" export: renders many inventory projects in a process pool
+and either merges them into one PDF with a table of contents (needs pypdf) or
+streams them into a ZIP archive, one PDF per project.
+
+Only a bounded number of projects is in flight at a time, and finished PDFs are
+spooled to temporary files (book) or written straight into the archive (ZIP),
+so memory use does not grow with the size of the selection.
+"""
+import io
+import os
+import shutil
+import zipfile
+import weakref
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import storage
+import yarn_estimate
+import pattern_document
+from pdf_export import PDF, create_pdf
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+TOC_LINES_PER_PAGE = 32
+
+
+def _render_project(key, data, image_bytes, numbered):
+    """Worker: one project -> (key, title, pdf bytes, page count)."""
+    title = data.get("project_name", data.get("name", key))
+    pdf_bytes = create_pdf(pattern_document.build_document(data), io.BytesIO(image_bytes) if image_bytes else None, title=title,
+                           estimate=yarn_estimate.estimate(data), numbered=numbered)
+    pages = len(pypdf.PdfReader(io.BytesIO(pdf_bytes)).pages) if pypdf else None
+    return key, title, pdf_bytes, pages
+
+
+def _render_all(backend, keys, workers, progress, numbered=True):
+    """Yields rendered projects as they finish (any order), keeping at most 2 per worker in flight."""
+    workers = workers or os.cpu_count() or 1
+    total = len(keys)
+    done_count = 0
+    # spawn: safe to start from the Streamlit server's threads, and workers only import what they need
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = set()
+        queue = iter(keys)
+        while True:
+            for key in queue:
+                data, image_bytes = storage.load_pattern(backend, key)
+                pending.add(pool.submit(_render_project, key, data, image_bytes, numbered))
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                return
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                result = fut.result()
+                done_count += 1
+                if progress:
+                    progress(done_count, total, result[1])
+                yield result
+
+
+def export_zip(backend, keys, out, workers=None, progress=None):
+    """Writes one PDF per project into a ZIP written to `out` (a path or binary file object, need not be seekable)."""
+    used_names = set()
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for key, title, pdf_bytes, _ in _render_all(backend, keys, workers, progress):
+            name = f"{storage.safe_filename(title) or key} Ani-gurumi.pdf"
+            if name in used_names:
+                name = f"{key} Ani-gurumi.pdf"
+            used_names.add(name)
+            archive.writestr(name, pdf_bytes)
+
+
+def _toc_pdf(entries, book_title):
+    """Table of contents pages; entries are (title, first page number)."""
+    pdf = PDF(text="".join([book_title] + [title for title, _ in entries]), numbered=False)
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    pdf.set_font(pdf.family, 'B', 24)
+    pdf.cell(0, 14, pdf.prepare(book_title), 0, 1, 'C')
+    pdf.ln(6)
+    pdf.set_font(pdf.family, '', 12)
+    for title, page in entries:
+        pdf.cell(170, 7, pdf.prepare(title), 0, 0, 'L')
+        pdf.cell(0, 7, str(page), 0, 1, 'R')
+    return pdf.output(dest='S').encode('latin-1')
+
+
+class _PageNumbers(PDF):
+    def header(self):
+        pass  # the project pages underneath have their own
+
+
+def _page_numbers(count):
+    """`count` blank pages that only carry the "Page N" footer, to stamp onto the merged book."""
+    pdf = _PageNumbers(numbered=False)
+    pdf.set_auto_page_break(auto=False)
+    for number in range(1, count + 1):
+        pdf.add_page()
+        pdf.page_number(number)
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def export_book(backend, keys, out, title="Ani-Gurumi Pattern Book", workers=None, progress=None):
+    """Renders all projects in parallel and merges them, in `keys` order, into one PDF with a table of contents."""
+    if pypdf is None:
+        raise RuntimeError("Merged pattern books need the 'pypdf' package (pip install pypdf). ZIP export works without it.")
+
+    spool = tempfile.mkdtemp(prefix="anigurumi-book-")
+    try:
+        rendered = {}
+        # Without their own footers: every project would start again at "Page 1"
+        for key, project_title, pdf_bytes, pages in _render_all(backend, keys, workers, progress, numbered=False):
+            path = os.path.join(spool, f"{len(rendered)}.pdf")
+            with open(path, "wb") as f:
+                f.write(pdf_bytes)
+            rendered[key] = (project_title, path, pages)
+
+        ordered = [rendered[k] for k in keys if k in rendered]
+        # Page numbers depend on how long the TOC itself is; start from an estimate and re-render if it was off
+        toc_pages = max(1, -(-(len(ordered) + 3) // TOC_LINES_PER_PAGE))
+        while True:
+            entries = []
+            page = toc_pages + 1
+            for project_title, _, pages in ordered:
+                entries.append((project_title, page))
+                page += pages
+            toc = _toc_pdf(entries, title)
+            actual = len(pypdf.PdfReader(io.BytesIO(toc)).pages)
+            if actual == toc_pages:
+                break
+            toc_pages = actual
+
+        writer = pypdf.PdfWriter()
+        writer.append(io.BytesIO(toc))
+        for project_title, path, _ in ordered:
+            # Bookmark per project, so PDF viewers show a clickable outline too
+            writer.append(path, outline_item=project_title)
+        # Number the merged pages, so the footers match the table of contents
+        numbers = pypdf.PdfReader(io.BytesIO(_page_numbers(len(writer.pages))))
+        for page, number in zip(writer.pages, numbers.pages):
+            page.merge_page(number)
+        writer.write(out)
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+
+
+class BookFile:
+    """
+    A built book on disk (path, download name, MIME type). The file is deleted
+    with the object, e.g. when the Streamlit session holding it ends, or at exit.
+    """
+
+    def __init__(self, path, name, mime):
+        self.path = path
+        self.name = name
+        self.mime = mime
+        self._finalizer = weakref.finalize(self, _unlink, path)
+
+    def delete(self):
+        self._finalizer()
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,185 @@
+"""
+Intermediate document model shared by the PDF export and the Streamlit quest log.
+
+build_document(pattern_data) classifies a pattern once into a flat tuple of
+typed blocks (title, summary, hybrid part, headings, parts, steps, colour
+changes, round counters, notes) and memoizes the result per pattern version,
+so neither renderer has to serialize the pattern to markdown and parse it back.
+Legacy inventory files that only have a markdown "text" blob are classified
+line by line the same way, once.
+
+Blocks are immutable namedtuples; renderers dispatch on their type.
+"""
+import re
+import json
+import functools
+import collections
+
+import yarn_estimate
+
+Title = collections.namedtuple("Title", "text")
+Summary = collections.namedtuple("Summary", "difficulty materials")  # materials: tuple of str
+Hybrid = collections.namedtuple("Hybrid", "type description search_term")
+Heading = collections.namedtuple("Heading", "level text")
+Part = collections.namedtuple("Part", "index name")
+# part/index address the step within components (checkbox keys "step_{part}_{index}")
+Step = collections.namedtuple("Step", "part index text")
+ColourChange = collections.namedtuple("ColourChange", "part index text colour")
+RoundCounter = collections.namedtuple("RoundCounter", "text")
+Note = collections.namedtuple("Note", "text")
+
+Document = collections.namedtuple("Document", "title blocks")
+
+# Fields holding display text (what translation/PDF cleanup applies to)
+TEXT_FIELDS = {"text", "difficulty", "materials", "type", "description", "name", "colour"}
+
+
+def get_round_counter_text(step_text):
+    """
+    Parses step text for round ranges and returns a plain text string of numbers.
+    Returns None if no range found.
+    """
+    # Regex to find ranges like "Rnd 5-10", "Rnds 5-10", "Row 5-10", "R 5-10", "Varv 5-10", "R8-R14", "v8-v15" (Swedish)
+    # Case insensitive, handles optional spaces, dots, plurals, different separators, and repeated prefixes
+    match = re.search(r'(?:Rnds?|Rows?|Rs?|Varv|Rounds?|V)\.?\s*(\d+)\s*(?:-|–|to)\s*(?:(?:Rnds?|Rows?|Rs?|Varv|Rounds?|V)\.?\s*)?(\d+)', step_text, re.IGNORECASE)
+
+    if match:
+        try:
+            start = int(match.group(1))
+            end = int(match.group(2))
+
+            # Only generate if it's a valid range and not too huge
+            if start < end and (end - start) < 50:
+                numbers = []
+                count = 0
+                for i in range(start, end + 1):
+                    numbers.append(str(i))
+                    count += 1
+                    # Add separator every 5 numbers, but not at the very end
+                    if count % 5 == 0 and i != end:
+                        numbers.append("|")
+
+                return " ".join(numbers)
+        except:
+            pass
+    return None
+
+
+def _step_blocks(part, index, text):
+    colour = yarn_estimate.colour_change(text)
+    blocks = [ColourChange(part, index, text, colour) if colour else Step(part, index, text)]
+    counter = get_round_counter_text(text)
+    if counter:
+        blocks.append(RoundCounter(counter))
+    return blocks
+
+
+# --- BUILDING ---
+
+def _from_components(data):
+    title = data.get('project_name', 'Crochet Pattern')
+    blocks = [
+        Title(title),
+        Summary(data.get('difficulty', 'Unknown'), tuple(m for m in data.get('materials', []) if isinstance(m, str))),
+    ]
+    hybrid = data.get('hybrid_suggestion')
+    if hybrid:
+        blocks.append(Hybrid(hybrid.get('type'), hybrid.get('description'), hybrid.get('search_term')))
+
+    blocks.append(Heading(2, "Pattern"))
+    for i, comp in enumerate(data.get('components', [])):
+        blocks.append(Part(i, comp.get('name', 'Part')))
+        for j, step in enumerate(comp.get('steps', [])):
+            blocks.extend(_step_blocks(i, j, step))
+    return Document(title, tuple(blocks))
+
+
+_LIST_MARKER = re.compile(r"^(?:[-*•]|\d+\.)\s+")
+
+
+def document_from_markdown(text, title=None):
+    """Classifies markdown (legacy inventory "text", raw model output) into blocks, once."""
+    blocks = []
+    part = -1
+    index = 0
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if not stripped:
+            continue
+
+        if stripped.startswith('#'):
+            level = len(stripped.split(' ')[0])
+            content = stripped.lstrip('#').strip()
+            if level == 1:
+                blocks.append(Title(content))
+                continue
+            if level == 2:
+                blocks.append(Heading(2, content))
+                continue
+        elif not (stripped.startswith('**') and stripped.endswith(('**', ':**', '**:'))):
+            content = None
+        else:
+            # A bold line on its own ("**Huvud:**") starts a part
+            content = stripped.strip('*: ')
+
+        if content is not None:
+            part += 1
+            index = 0
+            blocks.append(Part(part, content))
+        elif part >= 0 and _LIST_MARKER.match(stripped):
+            blocks.extend(_step_blocks(part, index, _LIST_MARKER.sub('', stripped)))
+            index += 1
+        else:
+            blocks.append(Note(_LIST_MARKER.sub('', stripped) if part >= 0 else stripped))
+
+    # Bold lines without any steps after them were section titles, not parts
+    has_steps = {b.part for b in blocks if isinstance(b, (Step, ColourChange))}
+    blocks = [Heading(3, b.name) if isinstance(b, Part) and b.index not in has_steps else b for b in blocks]
+
+    if title is None:
+        title = next((b.text for b in blocks if isinstance(b, Title)), 'Crochet Pattern')
+    return Document(title, tuple(blocks))
+
+
+@functools.lru_cache(maxsize=32)
+def _build(pattern_json):
+    data = json.loads(pattern_json)
+    if not data.get('components') and data.get('text'):
+        return document_from_markdown(data['text'], data.get('project_name', data.get('name')))
+    return _from_components(data)
+
+
+def build_document(pattern_data):
+    """pattern_data -> Document, memoized per pattern version (saved checkbox progress is ignored)."""
+    content = {k: v for k, v in pattern_data.items() if k not in ('progress', 'project_id')}
+    return _build(json.dumps(content, sort_keys=True, ensure_ascii=False))
+
+
+def texts(document):
+    """All display strings of document, title first, in document order."""
+    found = [document.title]
+    for block in document.blocks:
+        for field, value in zip(block._fields, block):
+            if field in TEXT_FIELDS and value:
+                found.extend(value if isinstance(value, tuple) else [value])
+    return found
+
+
+def map_texts(document, convert):
+    """
+    Returns a copy of document with all display text replaced. convert gets every
+    string in document order in ONE call and returns the converted list, so
+    renderers can clean a whole document in a single pass.
+    """
+    converted = iter(convert(texts(document)))
+
+    title = next(converted)
+    blocks = []
+    for block in document.blocks:
+        values = []
+        for field, value in zip(block._fields, block):
+            if field in TEXT_FIELDS and value:
+                value = tuple(next(converted) for _ in value) if isinstance(value, tuple) else next(converted)
+            values.append(value)
+        blocks.append(type(block)(*values))
+    return Document(title, tuple(blocks))
@@ -0,0 +1,545 @@
+"""
+PDF export for Ani-Gurumi AI patterns.
+
+Kept free of Streamlit so it can be imported by worker processes and scripts.
+Text goes through one pass per document: NFC normalization, markdown emphasis
+removal and a precomputed replacement table. A Unicode TrueType font that can
+draw the document is embedded (fpdf only writes the glyphs actually used, i.e. a
+subset), so names like "Gojō", "Hår" or "五条悟" survive; the app bundles one
+(fonts/). Letters no font can draw print as "?", the same as with the built-in
+latin-1 Arial that is used when the text fits in latin-1 or no TTF loads at all.
+
+Needs fpdf 1.7.2 exactly: the font sharing below uses its internals
+(fonts[...]['cw'], font_files, subset, TTFontFile.makeSubset, FPDF_CACHE_MODE).
+
+Run `python pdf_export.py [pattern.json ...]` for throughput numbers.
+"""
+import os
+import re
+import sys
+import copy
+import collections
+import tempfile
+import warnings
+import threading
+import unicodedata
+
+from PIL import Image
+import fpdf.fpdf
+from fpdf import FPDF
+
+import pattern_document
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+LOGO_PATH = os.path.join(APP_DIR, "logo.png")
+
+# Per document, the first font that can draw all of its text wins. PDF_FONT_PATH can
+# point at any TTF; DejaVu covers Latin, Greek and Cyrillic (with bold and italic).
+# The bundled Noto Sans CJK subset (fonts/subset_font.py) adds kana and JIS kanji,
+# so Japanese names print even where no such font is installed.
+BUNDLED_FONT = os.path.join(APP_DIR, "fonts", "NotoSansCJK-Subset.ttf")
+FONT_CANDIDATES = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    BUNDLED_FONT,
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+# Style variants next to the regular file (DejaVuSans-Bold.ttf, arialbd.ttf, ...)
+STYLE_SUFFIXES = {"B": ["-Bold", "bd"], "I": ["-Oblique", "-Italic", "i"]}
+
+UNICODE_FAMILY = "PatternSans"
+FALLBACK_FAMILY = "Arial"
+
+# Typographic characters the model likes that are pointless in a crochet pattern
+REPLACEMENTS = {'”': '"', '“': '"', '„': '"', '’': "'", '‘': "'", '–': '-', '—': '-',
+                '…': '...', '\u00a0': ' ', '\u200b': '', '\ufe0f': ''}
+
+
+# --- FONTS ---
+
+_font_lock = threading.Lock()
+_font_cache = {}  # (style, path) -> (fonts entry, font_files entry) parsed once per process
+
+# fpdf would otherwise try to write a .pkl metrics cache next to the (system) font file
+fpdf.fpdf.FPDF_CACHE_MODE = 1
+# fpdf's subsetter warns for characters above U+8000 (most kanji) while writing the embedded
+# font's cmap; PDF viewers do not use that table for Identity-H fonts, the text renders fine
+warnings.filterwarnings("ignore", message="cmap value too big/small", module="fpdf.ttfonts")
+
+
+def _parse_font(style, path):
+    """add_font(uni=True) into a scratch FPDF, once per process and file."""
+    with _font_lock:
+        if (style, path) not in _font_cache:
+            fontkey = UNICODE_FAMILY.lower() + style
+            scratch = FPDF()
+            scratch.add_font(UNICODE_FAMILY, style, path, uni=True)
+            _font_cache[style, path] = (scratch.fonts[fontkey], scratch.font_files[fontkey])
+        return _font_cache[style, path]
+
+
+def _cached(key, build):
+    """Looks key up in the embedded-font cache, calling build() on a miss."""
+    with _font_lock:
+        if key in _embed_cache:
+            _embed_cache.move_to_end(key)
+            return _embed_cache[key]
+    value = build()
+    with _font_lock:
+        _embed_cache[key] = value
+        while len(_embed_cache) > EMBED_CACHE_SIZE:
+            _embed_cache.popitem(last=False)
+    return value
+
+
+class _CachedSubsetFont(fpdf.fpdf.TTFontFile):
+    """
+    fpdf re-reads the whole TTF for every embedded font on every output(); the
+    subset it builds only depends on the file and the characters used, so the
+    bytes (and the glyph map written next to them) are kept between exports.
+    """
+
+    def makeSubset(self, file, subset):
+        def build():
+            return super(_CachedSubsetFont, self).makeSubset(file, subset), self.codeToGlyph, self.maxUni
+        stream, self.codeToGlyph, self.maxUni = _cached(("subset", file, tuple(subset)), build)
+        return stream
+
+
+# Embedded font subsets and their width arrays, least recently used first. Keys hold the
+# characters a document uses, so re-exporting the same pattern (every rerun) is a hit.
+_embed_cache = collections.OrderedDict()
+EMBED_CACHE_SIZE = 64
+fpdf.fpdf.TTFontFile = _CachedSubsetFont
+
+
+def _needed_chars(text):
+    """The distinct characters of text a font must have (after the replacement table)."""
+    text = unicodedata.normalize('NFC', text)
+    return {c for char in set(text) if not char.isascii() for c in REPLACEMENTS.get(char, char)}
+
+
+def find_unicode_font(text=""):
+    """
+    Returns {style: path} of the available Unicode TTF that can draw the most
+    characters of text (the earliest one on a tie, so Latin text keeps DejaVu),
+    or None if there is none or the text fits in latin-1 (the core Arial draws
+    that without embedding anything). Only styles with their own file are listed.
+    """
+    needed = _needed_chars(text)
+    if all(ord(c) < 256 for c in needed):
+        return None
+    configured = os.getenv("PDF_FONT_PATH")
+    paths = [p for p in ([configured] if configured else []) + FONT_CANDIDATES if p and os.path.exists(p)]
+    best, best_count = None, -1
+    for path in paths:
+        try:
+            glyphs = _glyph_set(_parse_font("", path)[0]['cw'])
+        except Exception as e:
+            print(f"Could not read font {path}: {e}")
+            continue
+        count = sum(c in glyphs for c in needed)
+        if count > best_count:
+            best, best_count = path, count
+        if count == len(needed):
+            break
+    if best is None:
+        return None
+
+    base, ext = os.path.splitext(best)
+    styles = {"": best}
+    for style, suffixes in STYLE_SUFFIXES.items():
+        # Missing variants are not registered: PDF.set_font falls back to the regular face
+        # instead of embedding the same file once more per style
+        variant = next((base + s + ext for s in suffixes if os.path.exists(base + s + ext)), None)
+        if variant:
+            styles[style] = variant
+    return styles
+
+
+class GlyphSet:
+    """Answers "can the font draw this character?" from fpdf's char widths, with a cache."""
+
+    def __init__(self, char_widths):
+        self.char_widths = char_widths
+        self._known = {}
+
+    def __contains__(self, char):
+        if char not in self._known:
+            cp = ord(char)
+            widths = self.char_widths
+            if isinstance(widths, dict):
+                self._known[char] = cp in widths
+            else:
+                self._known[char] = cp < len(widths) and bool(widths[cp])
+        return self._known[char]
+
+
+# --- PDF ---
+
+class PDF(FPDF):
+    def __init__(self, *args, text="", numbered=True, **kwargs):
+        """
+        text: everything the document will print, so a font that can draw it is picked.
+        numbered=False leaves out the "Page N" footers (pattern books number the merged pages).
+        """
+        super().__init__(*args, **kwargs)
+        self.numbered = numbered
+        self.family = FALLBACK_FAMILY
+        self.glyphs = None
+        styles = find_unicode_font(text)
+        if styles:
+            try:
+                self._add_unicode_font(styles)
+                self.family = UNICODE_FAMILY
+                self.glyphs = _glyph_set(self.fonts[UNICODE_FAMILY.lower()]['cw'])
+            except Exception as e:
+                print(f"Could not load Unicode font, using Arial: {e}")
+
+    def _add_unicode_font(self, styles):
+        """add_font(uni=True), but each TTF is parsed only once per process."""
+        for style, path in styles.items():
+            fontkey = UNICODE_FAMILY.lower() + style
+            font, font_file = _parse_font(style, path)
+            entry = dict(font)
+            entry['i'] = len(self.fonts) + 1
+            # The subset (characters used) is per document; everything else is shared read-only
+            entry['subset'] = copy.copy(font['subset'])
+            self.fonts[fontkey] = entry
+            self.font_files[fontkey] = dict(font_file)
+            self.font_files[path] = {'type': "TTF"}
+
+    def set_font(self, family, style='', size=0):
+        # Styles without their own file (e.g. the bundled font has no bold) use the regular face
+        if family == UNICODE_FAMILY and UNICODE_FAMILY.lower() + style not in self.fonts:
+            style = ''
+        super().set_font(family, style, size)
+
+    def _putTTfontwidths(self, font, maxUni):
+        # fpdf walks every code point of the font here (with a list lookup each); the
+        # resulting /W line only depends on the same things as the subset
+        def build():
+            lines = []
+            self._out = lines.append
+            try:
+                super(PDF, self)._putTTfontwidths(font, maxUni)
+            finally:
+                del self._out
+            return lines
+        for line in _cached(("widths", font['ttffile'], tuple(font['subset']), maxUni), build):
+            self._out(line)
+
+    def header(self):
+        if self.page_no() > 1: # No header on cover page
+            self.set_font(self.family, 'I', 10)
+            self.cell(0, 10, self.prepare('Ani-Gurumi AI - Crochet Pattern'), 0, 1, 'R')
+            self.ln(5)
+
+    def footer(self):
+        if self.numbered:
+            self.page_number(self.page_no())
+
+    def page_number(self, number):
+        self.set_y(-15)
+        self.set_font(self.family, 'I', 8)
+        self.cell(0, 10, f'Page {number}', 0, 0, 'C')
+
+    def prepare(self, text):
+        """Runs text through the one-pass pipeline for this document's font."""
+        return prepare_text(text, self.glyphs)
+
+    def cover_page(self, title, image_path=None):
+        self.add_page()
+
+        # Logo (small at top)
+        if os.path.exists(LOGO_PATH):
+            try:
+                # 30mm width, centered
+                x_pos = (210 - 30) / 2
+                self.image(LOGO_PATH, x=x_pos, y=10, w=30)
+            except:
+                pass
+
+        self.set_font(self.family, 'B', 24)
+        self.ln(30) # Move down (past logo)
+
+        # Title
+        self.cell(0, 10, self.prepare(title) or "Crochet Pattern", 0, 1, 'C')
+        self.ln(10)
+
+        # Image
+        if image_path:
+            try:
+                # Center image (A4 width 210mm)
+                # Image width 70mm (smaller to fit tall images)
+                x_pos = (210 - 70) / 2
+                self.image(image_path, x=x_pos, w=70)
+            except:
+                pass
+
+        self.ln(20)
+        self.set_font(self.family, '', 14)
+        self.cell(0, 10, "Created by Ani-Gurumi AI", 0, 1, 'C')
+        self.add_page() # New page for text
+
+
+_glyph_sets = {}
+
+
+def _glyph_set(char_widths):
+    # One per parsed font, so its cache is shared by all exports
+    key = id(char_widths)
+    if key not in _glyph_sets:
+        _glyph_sets[key] = GlyphSet(char_widths)
+    return _glyph_sets[key]
+
+
+def _fix_char(char, glyphs):
+    """What a single character becomes in the PDF (itself when nothing needs to change)."""
+    fixed = REPLACEMENTS.get(char, char)
+    if glyphs is not None:
+        # What the font cannot draw: emojis and other symbols are dropped, but
+        # letters, digits and punctuation become "?" so nothing vanishes unnoticed
+        return "".join(c if c in glyphs or c < " " else _missing(c) for c in fixed)
+    return fixed.encode('latin-1', 'replace').decode('latin-1')
+
+
+def _missing(char):
+    return "" if unicodedata.category(char)[0] in "SMC" else "?"
+
+
+def prepare_text(text, glyphs=None):
+    """
+    Normalizes a whole document in one pass: NFC, no markdown emphasis, plain
+    quotes/dashes, and only characters the target font can draw (latin-1 with '?'
+    replacements when there is no Unicode font).
+
+    Instead of a replace per rule per line, the distinct characters of the document
+    are checked once and everything that needs fixing goes in a single regex pass.
+    """
+    text = unicodedata.normalize('NFC', text).replace('**', '').replace('__', '')
+    if text.isascii():
+        return text
+    fixes = {}
+    for char in set(text):
+        if not char.isascii():
+            fixed = _fix_char(char, glyphs)
+            if fixed != char:
+                fixes[char] = fixed
+    if not fixes:
+        return text
+    pattern = re.compile("[" + "".join(re.escape(c) for c in fixes) + "]")
+    return pattern.sub(lambda m: fixes[m.group()], text)
+
+
+def _estimate_section(pdf, estimate):
+    """Size & yarn table from yarn_estimate.estimate()."""
+    pdf.set_font(pdf.family, 'B', 14)
+    pdf.ln(4)
+    pdf.cell(0, 10, "Size & Yarn Estimate", 0, 1, 'L')
+    pdf.set_font(pdf.family, '', 10)
+    pdf.cell(0, 6, f"{estimate['yarn_weight']} yarn, {estimate['hook_mm']:g} mm hook. Sizes are stuffed width x height.", 0, 1, 'L')
+    pdf.ln(2)
+
+    widths = (90, 20, 40, 30)
+    pdf.set_font(pdf.family, 'B', 11)
+    for width, label in zip(widths, ("Part", "Rounds", "Size (cm)", "Yarn (m)")):
+        pdf.cell(width, 7, label, 'B', 0, 'L')
+    pdf.ln()
+    pdf.set_font(pdf.family, '', 11)
+    for part in estimate['parts']:
+        row = (pdf.prepare(part['name'])[:48], str(part['rounds']), f"{part['width_cm']} x {part['height_cm']}", str(part['yarn_m']))
+        for width, value in zip(widths, row):
+            pdf.cell(width, 7, value, 0, 0, 'L')
+        pdf.ln()
+
+    pdf.ln(2)
+    colours = ", ".join(f"{name} {metres} m" for name, metres in estimate['colours'])
+    pdf.multi_cell(0, 6, pdf.prepare(f"Yarn per colour: {colours} (total {estimate['total_m']} m incl. 15% for tails and sewing)"))
+
+
+def create_pdf(document, image_file, title="Crochet Pattern", estimate=None, numbered=True):
+    """
+    document is a pattern_document.Document (markdown text is classified first).
+    Renders its blocks directly; no markdown round-trip.
+    """
+    if isinstance(document, str):
+        document = pattern_document.document_from_markdown(document)
+
+    pdf = PDF(text="".join([title] + pattern_document.texts(document)), numbered=numbered)
+
+    # Handle image for cover page
+    tmp_filename = None
+    if image_file:
+        try:
+            img = Image.open(image_file)
+            if img.mode in ("RGBA", "P"):
+                img = img.convert("RGB")
+            with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
+                img.save(tmp_file, format="JPEG")
+                tmp_filename = tmp_file.name
+        except:
+            pass
+
+    # Create cover page
+    pdf.cover_page(title, tmp_filename)
+
+    pdf.set_auto_page_break(auto=True, margin=15)
+
+    # All text of the document cleaned in one pass (\x1f survives prepare() and separates the strings)
+    document = pattern_document.map_texts(document, lambda texts: pdf.prepare("\x1f".join(texts)).split("\x1f"))
+
+    for block in document.blocks:
+        kind = type(block)
+        if kind is pattern_document.Title:
+            pdf.set_font(pdf.family, 'B', 16)
+            pdf.ln(5)
+            pdf.cell(0, 10, block.text, 0, 1, 'L')
+            pdf.ln(2)
+        elif kind is pattern_document.Summary:
+            pdf.set_font(pdf.family, '', 12)
+            pdf.multi_cell(0, 6, f"Difficulty: {block.difficulty}")
+            pdf.ln(5)
+            pdf.multi_cell(0, 6, "Materials:")
+            for material in block.materials:
+                pdf.set_x(15)
+                pdf.multi_cell(0, 6, f"- {material}")
+            pdf.ln(5)
+        elif kind is pattern_document.Hybrid:
+            pdf.set_font(pdf.family, '', 12)
+            pdf.multi_cell(0, 6, "Hybrid Mode Suggestion:")
+            for label, value in (("Type", block.type), ("Description", block.description)):
+                pdf.set_x(15)
+                pdf.multi_cell(0, 6, f"- {label}: {value}")
+            pdf.ln(5)
+        elif kind is pattern_document.Heading:
+            if block.level <= 2:
+                pdf.set_font(pdf.family, 'B', 14)
+                pdf.ln(4)
+                pdf.cell(0, 10, block.text, 0, 1, 'L')
+            else:
+                pdf.set_font(pdf.family, 'B', 12)
+                pdf.cell(0, 8, block.text, 0, 1, 'L')
+        elif kind is pattern_document.Part:
+            if block.index > 0:
+                pdf.ln(5)
+            pdf.set_font(pdf.family, 'B', 12)
+            pdf.cell(0, 8, block.name, 0, 1, 'L')
+        elif kind is pattern_document.Step or kind is pattern_document.ColourChange:
+            # Colour changes in bold so they stand out while crocheting
+            pdf.set_font(pdf.family, 'B' if kind is pattern_document.ColourChange else '', 12)
+            pdf.set_x(15)
+            pdf.multi_cell(0, 6, f"- {block.text}")
+        elif kind is pattern_document.RoundCounter:
+            pdf.set_font("Courier", 'B', 12) # Monospace for alignment
+            pdf.set_x(20) # Indent
+            pdf.cell(0, 6, block.text, 0, 1)
+            pdf.ln(2)
+        elif kind is pattern_document.Note:
+            pdf.set_font(pdf.family, '', 12)
+            pdf.multi_cell(0, 6, block.text)
+
+    if estimate:
+        _estimate_section(pdf, estimate)
+
+    output = pdf.output(dest='S').encode('latin-1')
+
+    # Clean up image
+    if tmp_filename:
+        try:
+            os.unlink(tmp_filename)
+        except:
+            pass
+
+    return output
+
+
+# --- BENCHMARK ---
+
+def _legacy_clean_text(text):
+    # The per-line cleanup create_pdf used before the one-pass pipeline
+    text = unicodedata.normalize('NFC', text)
+    text = text.replace('**', '')
+    text = text.replace('__', '')
+    replacements = {'”': '"', '“': '"', '’': "'", '–': '-', '—': '-'}
+    for k, v in replacements.items():
+        text = text.replace(k, v)
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+
+class _LegacyPDF(FPDF):
+    def header(self):
+        if self.page_no() > 1:
+            self.set_font('Arial', 'I', 10)
+            self.cell(0, 10, 'Ani-Gurumi AI - Crochet Pattern', 0, 1, 'R')
+            self.ln(5)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Page {self.page_no()}', 0, 0, 'C')
+
+
+def _legacy_create_pdf(text, title="Crochet Pattern"):
+    # The per-line, Arial-only export create_pdf replaced (cover page without logo or image)
+    pdf = _LegacyPDF()
+    pdf.add_page()
+    pdf.set_font('Arial', 'B', 24)
+    pdf.cell(0, 10, _legacy_clean_text(title), 0, 1, 'C')
+    pdf.add_page()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    for line in text.split('\n'):
+        clean_line = _legacy_clean_text(line).strip()
+        if not clean_line:
+            pdf.ln(5)
+            continue
+        if line.startswith('#'):
+            pdf.set_font("Arial", 'B', 14)
+            pdf.cell(0, 10, _legacy_clean_text(line.lstrip('#').strip()), 0, 1, 'L')
+            continue
+        pdf.set_font("Arial", '', 12)
+        if line.strip().startswith(('- ', '* ')) or re.match(r'^\d+\.', line.strip()):
+            pdf.set_x(15)
+        pdf.multi_cell(0, 6, clean_line)
+        counter_text = pattern_document.get_round_counter_text(clean_line)
+        if counter_text:
+            pdf.set_font("Courier", 'B', 12)
+            pdf.set_x(20)
+            pdf.cell(0, 6, counter_text, 0, 1)
+            pdf.ln(2)
+    return pdf.output(dest='S').encode('latin-1')
+
+
+def _benchmark(paths, rounds=20):
+    """Whole exports (no cover image) of each pattern, old per-line export against create_pdf."""
+    import json
+    import time
+
+    def timed(fn):
+        fn()  # warm-up: font parsing and the first subset are once per process
+        start = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        return (time.perf_counter() - start) / rounds
+
+    print(f"{'old export':>12}{'create_pdf':>12}  {'font':<24}pattern")
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        text = data.get("text") or json.dumps(data, ensure_ascii=False, indent=2)
+        name = os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+        # The same pattern once more with a title only an embedded Unicode font can print
+        for title in (name, name + " 五条悟"):
+            document = pattern_document.document_from_markdown(text)
+            old = timed(lambda: _legacy_create_pdf(text, title))
+            new = timed(lambda: create_pdf(document, None, title=title))
+            styles = find_unicode_font("".join([title] + pattern_document.texts(document)))
+            font = os.path.basename(styles[""]) if styles else FALLBACK_FAMILY
+            print(f"{old * 1000:>9.1f} ms{new * 1000:>9.1f} ms  {font:<24}{title}")
+
+
+if __name__ == "__main__":
+    import glob
+    _benchmark(sys.argv[1:] or sorted(glob.glob(os.path.join(APP_DIR, "saved_patterns", "*.json"))))
@@ -0,0 +1,207 @@
+"""
+Minimal in-memory Redis-protocol (RESP2) server for testing RedisBackend
+without a real Redis.
+
+Supports exactly the commands RedisBackend sends: PING, AUTH, SELECT, GET,
+SET (with NX and PX), MGET, DEL, EXISTS, SCAN (MATCH/COUNT), SADD, SREM and
+SMEMBERS. Each database is a dict (sets are Python sets); expired keys are
+dropped when they are read. Not meant for production.
+
+Usage:
+    python resp_server.py --port 6390
+    STORAGE_URL=redis://localhost:6390/0 streamlit run app.py
+
+or in-process (tests, benchmarks):
+    server = resp_server.start()      # port 0 = any free port
+    url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    ...
+    server.shutdown()
+"""
+import time
+import fnmatch
+import argparse
+import threading
+import socketserver
+
+
+class RespError(Exception):
+    pass
+
+
+class Store:
+    """Key -> (value bytes or set, expiry or None) per database, guarded by one lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.databases = {}
+
+    def db(self, index):
+        return self.databases.setdefault(index, {})
+
+
+def _bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(items):
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.selected = 0
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command ("PING\r\n"), as sent by telnet / redis-cli --no-raw
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (OSError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            try:
+                reply = self._execute(args[0].upper().decode(), args[1:])
+            except (RespError, ValueError, IndexError) as e:
+                reply = f"-ERR {e or 'syntax error'}\r\n".encode()
+            try:
+                self.wfile.write(reply)
+            except OSError:
+                return
+
+    def _execute(self, command, args):
+        store = self.server.store
+        if command == "PING":
+            return b"+PONG\r\n"
+        if command == "AUTH":
+            return b"+OK\r\n"
+        if command == "SELECT":
+            self.selected = int(args[0])
+            return b"+OK\r\n"
+
+        with store.lock:
+            db = store.db(self.selected)
+            now = time.monotonic()
+
+            def live(key):
+                entry = db.get(key)
+                if entry is not None and entry[1] is not None and entry[1] <= now:
+                    del db[key]
+                    return None
+                return entry
+
+            def typed(entry, kind):
+                if entry is not None and not isinstance(entry[0], kind):
+                    raise RespError("WRONGTYPE Operation against a key holding the wrong kind of value")
+                return entry[0] if entry else None
+
+            if command == "GET":
+                return _bulk(typed(live(args[0]), bytes))
+            if command == "MGET":
+                # MGET answers nil for keys of another type instead of failing
+                return _array([_bulk(e[0] if e and isinstance(e[0], bytes) else None) for e in map(live, args)])
+            if command == "SET":
+                key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+                expiry = None
+                if b"PX" in options:
+                    expiry = now + int(args[2 + options.index(b"PX") + 1]) / 1000
+                elif b"EX" in options:
+                    expiry = now + int(args[2 + options.index(b"EX") + 1])
+                if b"NX" in options and live(key) is not None:
+                    return b"$-1\r\n"
+                db[key] = (value, expiry)
+                return b"+OK\r\n"
+            if command == "DEL":
+                return b":%d\r\n" % sum(live(k) is not None and db.pop(k) is not None for k in args)
+            if command == "EXISTS":
+                return b":%d\r\n" % sum(live(k) is not None for k in args)
+            if command == "SADD":
+                members = typed(live(args[0]), set)
+                if members is None:
+                    members = set()
+                    db[args[0]] = (members, None)
+                added = len(set(args[1:]) - members)
+                members.update(args[1:])
+                return b":%d\r\n" % added
+            if command == "SREM":
+                members = typed(live(args[0]), set) or set()
+                removed = len(members & set(args[1:]))
+                members.difference_update(args[1:])
+                if not members:
+                    db.pop(args[0], None)
+                return b":%d\r\n" % removed
+            if command == "SMEMBERS":
+                return _array([_bulk(m) for m in typed(live(args[0]), set) or ()])
+            if command == "SCAN":
+                # The whole keyspace in one batch; cursor is always 0 afterwards
+                options = [a.upper() for a in args[1:]]
+                pattern = args[1 + options.index(b"MATCH") + 1].decode("utf-8") if b"MATCH" in options else "*"
+                keys = [k for k in list(db) if live(k) is not None and fnmatch.fnmatchcase(k.decode("utf-8"), _glob(pattern))]
+                return _array([_bulk(b"0"), _array([_bulk(k) for k in keys])])
+        raise RespError(f"unknown command '{command}'")
+
+
+def _glob(pattern):
+    """Redis MATCH pattern -> fnmatch pattern (backslash escapes become [x] classes)."""
+    out = []
+    chars = iter(pattern)
+    for ch in chars:
+        if ch == "\\":
+            escaped = next(chars, "\\")
+            out.append("[[]" if escaped == "[" else f"[{escaped}]")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        super().__init__(address, RespHandler)
+        self.store = Store()
+
+
+def start(port=0, host="127.0.0.1"):
+    """Starts a server on a background thread and returns it (port in server.server_address)."""
+    server = RespServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory Redis-protocol stand-in for testing RedisBackend.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    args = parser.parse_args()
+    server = RespServer((args.host, args.port))
+    print(f"Listening on redis://{args.host}:{server.server_address[1]}/0 (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,615 @@
+import os
+import sys
+import json
+import uuid
+import time
+import socket
+import sqlite3
+import tempfile
+import threading
+import contextlib
+from urllib.parse import urlparse
+
+import compact_format
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def safe_filename(name):
+    """Strips everything except letters, digits and spaces, and joins words with underscores."""
+    return "".join([c for c in name if c.isalpha() or c.isdigit() or c == ' ']).strip().replace(" ", "_")
+
+
+def atomic_write(path, data):
+    """Writes bytes to path via a temp file + rename, so readers never see a half-written file."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive cross-process lock on `<path>.lock` (blocks until acquired)."""
+    lock_path = f"{path}.lock"
+    with open(lock_path, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            # LK_LOCK retries for ~10s, so loop until we get it
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+# --- BACKENDS ---
+# Keys are "/"-separated strings. Inventory entries live at the top level
+# ("Naruto.json", "Naruto.png"); caches use their own prefix ("cache/...").
+
+class StorageBackend:
+    """Byte key-value store shared by the inventory functions and caches."""
+
+    def get(self, key):
+        """Returns the stored bytes, or None if the key does not exist."""
+        raise NotImplementedError
+
+    def get_many(self, keys):
+        """Returns a list of values (None for missing keys) in the same order as keys."""
+        return [self.get(k) for k in keys]
+
+    def put(self, key, data):
+        """Stores bytes under key, replacing any previous value atomically."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def keys(self, prefix="", recursive=True):
+        """
+        Returns all keys starting with prefix. recursive=False leaves out keys with
+        another "/" after the prefix, i.e. lists one level (the inventory without caches).
+        """
+        raise NotImplementedError
+
+    def lock(self, key):
+        """Context manager holding an exclusive lock on key across processes/replicas."""
+        raise NotImplementedError
+
+
+class LocalBackend(StorageBackend):
+    """Files on local (or network-mounted) disk under root."""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self, prefix="", recursive=True):
+        result = []
+        # Only walk the directory the prefix points into ("image_hashes/x" -> root/image_hashes)
+        start = self._path(prefix.rsplit("/", 1)[0]) if "/" in prefix else self.root
+        if not recursive:
+            rel_dir = prefix.rsplit("/", 1)[0] + "/" if "/" in prefix else ""
+            try:
+                entries = list(os.scandir(start))
+            except FileNotFoundError:
+                return result
+            return [rel_dir + e.name for e in entries
+                    if (rel_dir + e.name).startswith(prefix) and not e.name.endswith((".lock", ".tmp")) and e.is_file()]
+        for dirpath, _, filenames in os.walk(start):
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            for filename in filenames:
+                # Skip lock files and in-flight temp files
+                if filename.endswith((".lock", ".tmp")):
+                    continue
+                key = filename if rel_dir == "." else f"{rel_dir}/{filename}"
+                if key.startswith(prefix):
+                    result.append(key)
+        return result
+
+    def lock(self, key):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return file_lock(path)
+
+
+class SQLiteBackend(StorageBackend):
+    """Single SQLite file in WAL mode (one connection per thread)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; lock() opens an explicit transaction when needed
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        # Stay below SQLite's default host-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for k, v in self._conn().execute(f"SELECT key, value FROM kv WHERE key IN ({placeholders})", chunk):
+                found[k] = bytes(v)
+        return [found.get(k) for k in keys]
+
+    def put(self, key, data):
+        self._conn().execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, data))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def keys(self, prefix="", recursive=True):
+        # Range scan instead of LIKE so '_' and '%' in keys are not wildcards
+        query = "SELECT key FROM kv WHERE key >= ? AND key < ?"
+        params = (prefix, prefix + "\U0010ffff")
+        if not recursive:
+            query += " AND instr(substr(key, ?), '/') = 0"
+            params += (len(prefix) + 1,)
+        return [r[0] for r in self._conn().execute(query, params)]
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        # SQLite only has a database-wide write lock; hold it for the whole block
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(StorageBackend):
+    """
+    Minimal RESP2 client (GET/SET/MGET/DEL/SCAN, plus a set), so any Redis-protocol
+    server works (Redis, Valkey, KeyDB, a local stand-in) without an extra dependency.
+
+    SCAN walks the whole keyspace whatever MATCH says, so top-level keys (the
+    inventory, without caches and indexes) are also kept in a set for
+    keys(recursive=False). It is filled from one SCAN the first time it is needed.
+    """
+
+    LOCK_TTL_MS = 30000
+    TOP_LEVEL = "index:top-level"
+    TOP_LEVEL_READY = "index:top-level:ready"
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, namespace="anigurumi:"):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.namespace = namespace
+        self._local = threading.local()
+
+    # --- protocol ---
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=10)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        if self.password:
+            self._command("AUTH", self.password)
+        if self.db:
+            self._command("SELECT", str(self.db))
+
+    def _command(self, *args):
+        if getattr(self._local, "sock", None) is None:
+            self._connect()
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        try:
+            self._local.sock.sendall(b"".join(parts))
+            return self._read_reply()
+        except (OSError, ConnectionError):
+            # Drop the broken connection; the next command reconnects
+            self._local.sock = None
+            raise
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            if count == -1:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    # --- backend API ---
+
+    def get(self, key):
+        return self._command("GET", self.namespace + key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        return self._command("MGET", *[self.namespace + k for k in keys])
+
+    def put(self, key, data):
+        if "/" not in key:
+            # Before the value: a crash in between lists a missing key, never hides a stored one
+            self._command("SADD", self.namespace + self.TOP_LEVEL, key)
+        self._command("SET", self.namespace + key, data)
+
+    def delete(self, key):
+        self._command("DEL", self.namespace + key)
+        if "/" not in key:
+            self._command("SREM", self.namespace + self.TOP_LEVEL, key)
+
+    def _top_level_keys(self):
+        if not self._command("EXISTS", self.namespace + self.TOP_LEVEL_READY):
+            # Keys stored before the set existed (or by an older version of the app)
+            found = [k for k in self._scan("") if "/" not in k and not k.startswith(("lock:", "index:"))]
+            for i in range(0, len(found), 500):
+                self._command("SADD", self.namespace + self.TOP_LEVEL, *found[i:i + 500])
+            self._command("SET", self.namespace + self.TOP_LEVEL_READY, b"1")
+        return [k.decode("utf-8") for k in self._command("SMEMBERS", self.namespace + self.TOP_LEVEL)]
+
+    def keys(self, prefix="", recursive=True):
+        if not recursive and "/" not in prefix:
+            return [k for k in self._top_level_keys() if k.startswith(prefix)]
+        found = self._scan(prefix)
+        if not recursive:
+            found = [k for k in found if "/" not in k[len(prefix):]]
+        return found
+
+    def _scan(self, prefix):
+        # Escape glob characters so the prefix is matched literally
+        pattern = self.namespace + prefix
+        for ch in "\\*?[]":
+            pattern = pattern.replace(ch, "\\" + ch)
+        result = []
+        cursor = "0"
+        while True:
+            cursor, batch = self._command("SCAN", cursor, "MATCH", pattern + "*", "COUNT", "500")
+            cursor = cursor.decode() if isinstance(cursor, bytes) else cursor
+            result.extend(k.decode("utf-8")[len(self.namespace):] for k in batch)
+            if cursor == "0":
+                break
+        return result
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        lock_key = f"{self.namespace}lock:{key}"
+        token = uuid.uuid4().hex
+        # SET NX PX: the TTL frees the lock if a replica dies while holding it
+        while self._command("SET", lock_key, token, "NX", "PX", str(self.LOCK_TTL_MS)) is None:
+            time.sleep(0.01)
+        try:
+            yield
+        finally:
+            # Only release our own lock (best effort; no Lua needed on the server)
+            if self._command("GET", lock_key) == token.encode():
+                self._command("DEL", lock_key)
+
+
+def get_backend(url, default_dir):
+    """
+    Creates a backend from a URL:
+      "" / None            -> LocalBackend(default_dir)
+      "file:///path"       -> LocalBackend(path)  ("file:relative/dir" for a relative one)
+      "sqlite:///path.db"  -> SQLiteBackend(path)
+      "redis://[:password@]host:port/db" -> RedisBackend
+    """
+    if not url:
+        return LocalBackend(default_dir)
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        if parsed.netloc not in ("", "localhost") or not parsed.path:
+            # "file://inventory" parses as host "inventory" with no path, not a relative dir
+            raise ValueError(f"Unsupported file URL {url!r}: use file:///absolute/dir or file:relative/dir")
+        return LocalBackend(parsed.path)
+    if parsed.scheme == "sqlite":
+        # sqlite:///relative.db -> "relative.db", sqlite:////abs.db -> "/abs.db"
+        return SQLiteBackend(parsed.path[1:] if parsed.path.startswith("/") else parsed.path)
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisBackend(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+    raise ValueError(f"Unknown storage URL scheme: {parsed.scheme}")
+
+
+# --- INVENTORY ---
+# A pattern is stored as "<key>.json" (readable, the default) or "<key>.agp"
+# (compact_format, fmt="compact"), plus an optional "<key>.png" and the
+# project name in "names/<key>" (read by list_patterns instead of every pattern).
+
+PATTERN_EXTENSIONS = (".agp", ".json")
+NAME_PREFIX = "names/"
+DICTIONARY_POINTER = "dictionaries/current"
+MIN_DICTIONARY_SAMPLES = 8
+
+_dictionaries = {}  # id -> bytes (dictionaries are immutable once written)
+
+
+def _get_dictionary(backend, dict_id):
+    if dict_id not in _dictionaries:
+        data = backend.get(f"dictionaries/{dict_id:08x}")
+        if data is None:
+            raise FileNotFoundError(f"Compression dictionary {dict_id:08x} is missing")
+        _dictionaries[dict_id] = data
+    return _dictionaries[dict_id]
+
+
+def _current_dictionary(backend):
+    pointer = backend.get(DICTIONARY_POINTER)
+    if pointer is None:
+        return None
+    return _get_dictionary(backend, int(pointer))
+
+
+def train_inventory_dictionary(backend):
+    """(Re)trains the shared compression dictionary on the whole inventory. Returns its size in bytes."""
+    patterns = [load_pattern(backend, p["key"])[0] for p in list_patterns(backend)]
+    dictionary = compact_format.train_dictionary(patterns)
+    if not dictionary:
+        return 0
+    dict_id = compact_format.dictionary_id(dictionary)
+    # Old dictionaries stay: patterns written with them still need them to load
+    backend.put(f"dictionaries/{dict_id:08x}", dictionary)
+    backend.put(DICTIONARY_POINTER, str(dict_id).encode())
+    _dictionaries[dict_id] = dictionary
+    return len(dictionary)
+
+
+def _decode(backend, key, raw):
+    if key.endswith(".agp"):
+        dict_id = compact_format.required_dictionary(raw)
+        return compact_format.decode(raw, _get_dictionary(backend, dict_id) if dict_id else None)
+    return json.loads(raw)
+
+
+def _read_pattern(backend, key):
+    """Returns pattern_data stored under key (any format), or None."""
+    for ext in PATTERN_EXTENSIONS:
+        raw = backend.get(key + ext)
+        if raw is not None:
+            return _decode(backend, key + ext, raw)
+    return None
+
+
+def _display_name(pattern_data):
+    return pattern_data.get("project_name", pattern_data.get("name", "Unnamed Project"))
+
+
+def _read_project_id(backend, key):
+    try:
+        data = _read_pattern(backend, key)
+        return data.get("project_id") if data else None
+    except (ValueError, AttributeError):
+        return None
+
+
+def save_pattern(backend, name, pattern_data, image_bytes=None, fmt="json"):
+    """
+    Saves pattern data (and optional PNG bytes) without clobbering other projects.
+    Gives pattern_data a `project_id` if it has none. Returns the inventory key (without extension).
+    """
+    if not pattern_data.get("project_id"):
+        pattern_data["project_id"] = uuid.uuid4().hex
+    project_id = pattern_data["project_id"]
+
+    key = safe_filename(name) or "Unnamed"
+
+    # One lock per safe name: every project that could end up in this slot goes through it
+    with backend.lock(key):
+        existing_id = _read_project_id(backend, key)
+        if existing_id and existing_id != project_id:
+            # Name collision with another project (e.g. "Gojo!" vs "Gojo?") -> suffix with our id
+            short_key = f"{key}_{project_id[:8]}"
+            short_id = _read_project_id(backend, short_key)
+            if short_id and short_id != project_id:
+                short_key = f"{key}_{project_id}"
+            key = short_key
+
+        if fmt == "compact":
+            data = compact_format.encode(pattern_data, _current_dictionary(backend))
+            ext, stale_ext = ".agp", ".json"
+        else:
+            data = json.dumps(pattern_data, ensure_ascii=False, indent=2).encode("utf-8")
+            ext, stale_ext = ".json", ".agp"
+        backend.put(key + ext, data)
+        # Same project saved in the other format earlier -> remove the old copy
+        if backend.get(key + stale_ext) is not None:
+            backend.delete(key + stale_ext)
+        if image_bytes:
+            backend.put(f"{key}.png", image_bytes)
+        backend.put(NAME_PREFIX + key, _display_name(pattern_data).encode("utf-8"))
+
+    if fmt == "compact" and backend.get(DICTIONARY_POINTER) is None:
+        # First compact save on a big enough inventory: train the shared dictionary
+        with backend.lock("dictionaries"):
+            if backend.get(DICTIONARY_POINTER) is None and len(list_patterns(backend)) >= MIN_DICTIONARY_SAMPLES:
+                train_inventory_dictionary(backend)
+
+    return key
+
+
+def list_patterns(backend):
+    """
+    Returns [{"name", "key"}] for every pattern in the inventory, sorted by key.
+    Names come from the small "names/<key>" entries save_pattern writes, so the
+    patterns themselves are only read for projects saved before the index existed.
+    """
+    entries = {}
+    for k in backend.keys(recursive=False):
+        for ext in PATTERN_EXTENSIONS:
+            # .agp wins if a project somehow has both, the same as _read_pattern
+            if k.endswith(ext) and (k[:-len(ext)] not in entries or ext == PATTERN_EXTENSIONS[0]):
+                entries[k[:-len(ext)]] = k
+    keys = sorted(entries)
+    names = dict(zip(keys, backend.get_many([NAME_PREFIX + k for k in keys])))
+
+    missing = [k for k in keys if names[k] is None]
+    for k, raw in zip(missing, backend.get_many([entries[k] for k in missing])):
+        if raw is None:
+            continue
+        try:
+            name = _display_name(_decode(backend, entries[k], raw)).encode("utf-8")
+        except (ValueError, AttributeError, RuntimeError, FileNotFoundError):
+            continue
+        # No lock: list_patterns also runs inside save_pattern's dictionary lock, which
+        # SQLite cannot nest. Don't replace a name a save wrote in the meantime.
+        if backend.get(NAME_PREFIX + k) is None:
+            backend.put(NAME_PREFIX + k, name)
+        names[k] = name
+
+    return [{"name": names[k].decode("utf-8"), "key": k} for k in keys if names[k] is not None]
+
+
+def load_pattern(backend, key):
+    """Returns (pattern_data, image_bytes or None) for an inventory key."""
+    data = _read_pattern(backend, key)
+    if data is None:
+        raise FileNotFoundError(key)
+    return data, backend.get(f"{key}.png")
+
+
+def _benchmark(directory, redis_url=None, projects=50, rounds=5):
+    """Times the inventory operations on every backend. Without redis_url a local stand-in (resp_server) is used."""
+    import glob
+    import shutil
+
+    patterns = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            patterns.append(json.load(f))
+    if not patterns:
+        print(f"No .json patterns in {directory}")
+        return
+    patterns = [patterns[i % len(patterns)] for i in range(max(projects, len(patterns)))]
+    image = os.urandom(200 * 1024)  # about the size of an uploaded PNG
+
+    scratch = tempfile.mkdtemp(prefix="anigurumi-bench-")
+    server = None
+    if not redis_url:
+        import resp_server
+        server = resp_server.start()
+        redis_url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    backends = [
+        ("local", f"file://{os.path.join(scratch, 'inventory')}"),
+        ("sqlite", f"sqlite:///{os.path.join(scratch, 'inventory.db')}"),
+        ("redis" if server is None else "redis (stand-in)", redis_url),
+    ]
+
+    def timed(fn):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            result = fn()
+        return result, (time.perf_counter() - start) / rounds * 1000
+
+    print(f"{len(patterns)} projects (patterns from {directory}), {len(image) // 1024} KiB image each, {rounds} rounds")
+    print(f"{'backend':<18}{'save ms':>10}{'list ms':>10}{'load ms':>10}{'get_many ms':>13}")
+    try:
+        for label, url in backends:
+            backend = get_backend(url, scratch)
+            # Unique names per run, so a shared Redis is not mixed up with earlier runs
+            run = uuid.uuid4().hex[:8]
+            names = [f"bench {run} {i}" for i in range(len(patterns))]
+
+            def save_all():
+                return [save_pattern(backend, name, dict(p), image) for name, p in zip(names, patterns)]
+
+            keys, save_ms = timed(save_all)
+            listed, list_ms = timed(lambda: list_patterns(backend))
+            assert {e["key"] for e in listed} >= set(keys), f"{label}: saved patterns are missing from the listing"
+            _, load_ms = timed(lambda: [load_pattern(backend, k) for k in keys])
+            _, many_ms = timed(lambda: backend.get_many([k + ".json" for k in keys]))
+            print(f"{label:<18}{save_ms:>10.2f}{list_ms:>10.2f}{load_ms:>10.2f}{many_ms:>13.2f}")
+            for k in keys:
+                for full_key in (k + ".json", k + ".png", NAME_PREFIX + k):
+                    backend.delete(full_key)
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # python storage.py [pattern dir] [redis://host:port/db]
+    _benchmark(sys.argv[1] if len(sys.argv) > 1 else "saved_patterns", sys.argv[2] if len(sys.argv) > 2 else None)
@@ -0,0 +1,183 @@
+"""
+Stress test for concurrent inventory saves.
+
+Starts many processes that save projects at the same time under names that
+collide after safe_filename() ("Gojo! 1", "Gojo? 1" -> "Gojo_1"), and re-save
+each project several times, like replicas behind a load balancer.
+Afterwards every project must be in the inventory exactly once, under a key
+no other project uses, with the data and image of its last save, and no
+temporary files may be left behind.
+
+Usage:
+    python stress_storage.py --processes 8 --projects 5 --rounds 4
+    python stress_storage.py --url sqlite:///stress.db --format compact
+    python stress_storage.py --resp        # RedisBackend against a local resp_server stand-in
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+import storage
+
+COLLIDING_NAMES = ["Gojo!", "Gojo?", "Gojo.", "Gojo", "¡Gojo!"]
+
+
+class JitterBackend(storage.StorageBackend):
+    """
+    Wraps a backend and sleeps a random few milliseconds around every read and
+    write, like a network or NFS round-trip. Without it the unlocked windows are
+    so short that races rarely show up, especially on machines with few cores.
+    """
+
+    def __init__(self, backend, max_delay):
+        self.backend = backend
+        self.max_delay = max_delay
+
+    def _pause(self):
+        time.sleep(random.uniform(0, self.max_delay))
+
+    def get(self, key):
+        self._pause()
+        return self.backend.get(key)
+
+    def get_many(self, keys):
+        self._pause()
+        return self.backend.get_many(keys)
+
+    def put(self, key, data):
+        self._pause()
+        self.backend.put(key, data)
+        self._pause()
+
+    def delete(self, key):
+        self._pause()
+        self.backend.delete(key)
+
+    def keys(self, prefix="", recursive=True):
+        self._pause()
+        return self.backend.keys(prefix, recursive)
+
+    def lock(self, key):
+        return self.backend.lock(key)
+
+
+def _image(project_id, round_no):
+    return f"png:{project_id}:{round_no}".encode()
+
+
+def _worker(url, directory, worker, projects, rounds, fmt, jitter, start):
+    """Saves `projects` projects `rounds` times each; returns {project_id: (key, last round, key changes)}."""
+    backend = storage.get_backend(url, directory)
+    if jitter:
+        backend = JitterBackend(backend, jitter / 1000)
+    start.wait()
+    saved = {}
+    patterns = []
+    for p in range(projects):
+        # Project p of every process lands in the same slot ("Gojo!_3", "Gojo?_3" -> "Gojo_3"),
+        # and all processes walk the slots in the same order, so each slot is contended
+        name = f"{COLLIDING_NAMES[worker % len(COLLIDING_NAMES)]} {p}"
+        patterns.append((name, {"project_name": name, "project_id": uuid.uuid4().hex,
+                                "components": [{"name": "Head", "steps": []}]}))
+    # Interleave rounds across projects so saves of one process also overlap each other's keys
+    for round_no in range(rounds):
+        for name, data in patterns:
+            data["components"][0]["steps"] = [f"worker {worker}", f"round {round_no}"]
+            project_fmt = fmt if fmt != "mixed" else ("compact" if (worker + round_no) % 2 else "json")
+            key = storage.save_pattern(backend, name, data, _image(data["project_id"], round_no), fmt=project_fmt)
+            previous = saved.get(data["project_id"])
+            # A project's key never changes between saves; if it did, its earlier file was taken over
+            # by another project (a lost write that the re-save would otherwise hide)
+            moved = previous[2] if previous else []
+            if previous and previous[0] != key:
+                moved = moved + [f"round {round_no}: {previous[0]} -> {key}"]
+            saved[data["project_id"]] = (key, round_no, moved)
+    return saved
+
+
+def verify(backend, expected, directory=None):
+    """Returns a list of problems (empty = inventory is consistent)."""
+    problems = []
+    found = {}
+    for entry in storage.list_patterns(backend):
+        try:
+            data, image = storage.load_pattern(backend, entry["key"])
+        except Exception as e:
+            problems.append(f"{entry['key']}: unreadable ({e})")
+            continue
+        project_id = data.get("project_id")
+        if project_id in found:
+            problems.append(f"{project_id}: stored twice ({found[project_id]} and {entry['key']})")
+        found[project_id] = entry["key"]
+        if project_id not in expected:
+            problems.append(f"{entry['key']}: unknown project {project_id}")
+            continue
+        key, last_round, moved = expected[project_id]
+        for move in moved:
+            problems.append(f"{project_id}: key changed between saves ({move})")
+        if entry["key"] != key:
+            problems.append(f"{project_id}: expected under {key}, found under {entry['key']}")
+        if data["components"][0]["steps"][-1] != f"round {last_round}":
+            problems.append(f"{entry['key']}: lost update ({data['components'][0]['steps'][-1]!r}, expected round {last_round})")
+        if image != _image(project_id, last_round):
+            problems.append(f"{entry['key']}: image belongs to another save")
+
+    for project_id, (key, _, _) in expected.items():
+        if project_id not in found:
+            problems.append(f"{project_id}: missing (last saved as {key})")
+
+    if directory and os.path.isdir(directory):
+        leftovers = [f for f in os.listdir(directory) if f.endswith(".tmp")]
+        if leftovers:
+            problems.append(f"temporary files left behind: {leftovers}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer the inventory with concurrent saves from many processes.")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--projects", type=int, default=5, help="projects per process")
+    parser.add_argument("--rounds", type=int, default=4, help="saves per project")
+    parser.add_argument("--url", default="", help="STORAGE_URL to test (default: fresh local directory)")
+    parser.add_argument("--resp", action="store_true", help="test RedisBackend against an in-process resp_server")
+    parser.add_argument("--format", choices=["json", "compact", "mixed"], default="mixed")
+    parser.add_argument("--jitter", type=float, default=3.0, help="max ms of simulated latency per backend call (0 = off)")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="anigurumi-stress-")
+    if args.resp:
+        import resp_server
+        server = resp_server.start()
+        args.url = f"redis://127.0.0.1:{server.server_address[1]}/0"
+    context = multiprocessing.get_context("spawn")
+    start = context.Manager().Event()
+    began = time.perf_counter()
+    with context.Pool(args.processes) as pool:
+        results = [pool.apply_async(_worker, (args.url, directory, w, args.projects, args.rounds, args.format,
+                                               args.jitter, start))
+                   for w in range(args.processes)]
+        time.sleep(0.5)  # let every process get to the start line
+        start.set()
+        expected = {}
+        for result in results:
+            expected.update(result.get())
+    elapsed = time.perf_counter() - began
+
+    backend = storage.get_backend(args.url, directory)
+    problems = verify(backend, expected, None if args.url else directory)
+    saves = args.processes * args.projects * args.rounds
+    print(f"{saves} saves of {len(expected)} projects from {args.processes} processes in {elapsed:.1f}s "
+          f"({args.url or 'file://' + directory})")
+    for problem in problems:
+        print("  FAIL", problem)
+    print("OK" if not problems else f"{len(problems)} problems")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
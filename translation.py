@@ -0,0 +1,245 @@
+import re
+import json
+import hashlib
+import unicodedata
+
+LANGUAGES = {"en": "English", "sv": "Svenska", "de": "Deutsch", "es": "Español", "fr": "Français"}
+
+# --- RULE TABLES ---
+# Deterministic crochet terminology. A step whose words are ALL covered by the
+# target vocabulary after these substitutions never needs the model.
+# Patterns are applied in order (longest phrases first).
+
+RULES = {
+    ("sv", "en"): [
+        (r"\bi varje maska\b", "in each st"),
+        (r"\bi varje m\b", "in each st"),
+        (r"\bi bakre maskbågen\b", "in BLO"),
+        (r"\bi främre maskbågen\b", "in FLO"),
+        (r"\bmagisk ring\b", "MR"),
+        (r"\b2ihop\b", "dec"),
+        (r"\b2i1\b", "inc"),
+        (r"\bfm\b", "sc"),
+        (r"\bhst\b", "hdc"),
+        (r"\blm\b", "ch"),
+        (r"\bsm\b", "sl st"),
+        (r"\bvänd\b", "turn"),
+        (r"\bvarv\b", "rounds"),
+        (r"\bv(\d+)\b", r"R\1"),
+        (r"\bi\b", "in"),
+    ],
+    ("en", "sv"): [
+        (r"\bin each st(?:itch)?\b", "i varje m"),
+        (r"\bin BLO\b", "i bakre maskbågen"),
+        (r"\bin FLO\b", "i främre maskbågen"),
+        (r"\bsl st\b", "sm"),
+        (r"\bdec\b", "2ihop"),
+        (r"\binc\b", "2i1"),
+        (r"\bsc\b", "fm"),
+        (r"\bhdc\b", "hst"),
+        (r"\bch\b", "lm"),
+        (r"\bturn\b", "vänd"),
+        (r"\b(?:Rnds?|Rounds?|Rows?)\b", "varv"),
+        (r"\bR(\d+)\b", r"v\1"),
+        (r"\bin\b", "i"),
+    ],
+}
+
+VOCABULARY = {
+    "en": {"sc", "inc", "dec", "ch", "sl", "st", "mr", "r", "in", "each", "turn", "blo", "flo", "hdc", "dc", "x", "rounds", "round"},
+    "sv": {"fm", "i", "ihop", "lm", "sm", "mr", "v", "varje", "m", "vänd", "varv", "bakre", "främre", "maskbågen", "x"},
+}
+
+_compiled = {pair: [(re.compile(p, re.IGNORECASE), r) for p, r in rules] for pair, rules in RULES.items()}
+_WORD = re.compile(r"[^\W\d_]+")
+
+# Words that give a language away; used when pattern_data has no "language" key
+_MARKERS = {
+    "sv": {"fm", "2i1", "2ihop", "lm", "varv", "varje", "och", "med", "garn", "fyll", "virka", "sy", "fast"},
+    "en": {"sc", "inc", "dec", "ch", "round", "rounds", "each", "and", "with", "yarn", "stuff", "sew", "start"},
+}
+
+
+def normalize_step(text):
+    """NFC + collapsed whitespace, so trivially different copies share one memory entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def detect_language(texts):
+    """Best guess between the languages in _MARKERS (defaults to English)."""
+    scores = dict.fromkeys(_MARKERS, 0)
+    for text in texts:
+        for word in re.findall(r"\w+", text.lower()):
+            for lang, markers in _MARKERS.items():
+                if word in markers:
+                    scores[lang] += 1
+    return max(scores, key=lambda lang: (scores[lang], lang == "en"))
+
+
+def translate_by_rules(text, source, target):
+    """Returns the rule-based translation, or None if the text has words the rules do not cover."""
+    rules = _compiled.get((source, target))
+    if rules is None:
+        return None
+    result = text
+    for pattern, replacement in rules:
+        result = pattern.sub(replacement, result)
+    vocabulary = VOCABULARY[target]
+    if all(word.lower() in vocabulary for word in _WORD.findall(result)):
+        return result
+    return None
+
+
+# --- PATTERN WALKING ---
+# Text fields that get translated. project_name is a character name and stays as is.
+
+def _collect(pattern_data):
+    texts = []
+    if pattern_data.get("difficulty"):
+        texts.append(pattern_data["difficulty"])
+    texts.extend(pattern_data.get("materials", []))
+    hybrid = pattern_data.get("hybrid_suggestion") or {}
+    for field in ("type", "description"):
+        if hybrid.get(field):
+            texts.append(hybrid[field])
+    for comp in pattern_data.get("components", []):
+        if comp.get("name"):
+            texts.append(comp["name"])
+        texts.extend(comp.get("steps", []))
+    # Legacy inventory files only have a markdown "text" blob
+    if pattern_data.get("text"):
+        texts.extend(text for line in pattern_data["text"].split("\n") for text in _split_markup(line)[1::2])
+    return [t for t in texts if isinstance(t, str) and t.strip()]
+
+
+_HEADING_1 = re.compile(r"^\s*#(?!#)")
+_LINE_PREFIX = re.compile(r"^\s*(?:#+\s*|[*-]\s+|\d+\.\s+)?")
+# Bold markers with the colons and spaces around them, or a trailing colon
+_INLINE_MARKUP = re.compile(r"(\s*:?\s*\*\*\s*:?\s*|\s*:\s*$)")
+
+
+def _split_markup(line):
+    """
+    Splits a markdown line into [markup, text, markup, text, ..., markup] so only
+    the texts (odd positions) are translated and "".join() restores the line:
+    "**Svårighetsgrad:** Medel" -> ["", "", "**", "Svårighetsgrad", ":** ", "Medel", ""].
+    Level-1 headings hold the character name and stay as they are.
+    """
+    if _HEADING_1.match(line):
+        return [line]
+    prefix = _LINE_PREFIX.match(line).group()
+    return [prefix] + _INLINE_MARKUP.split(line[len(prefix):]) + [""]
+
+
+def _apply(pattern_data, lookup):
+    def tr(text):
+        return lookup.get(normalize_step(text), text) if isinstance(text, str) and text.strip() else text
+
+    data = dict(pattern_data)
+    if data.get("difficulty"):
+        data["difficulty"] = tr(data["difficulty"])
+    if "materials" in data:
+        data["materials"] = [tr(m) for m in data["materials"]]
+    if data.get("hybrid_suggestion"):
+        data["hybrid_suggestion"] = {k: tr(v) if k in ("type", "description") else v
+                                     for k, v in data["hybrid_suggestion"].items()}
+    if "components" in data:
+        data["components"] = [{**comp, "name": tr(comp.get("name", "")), "steps": [tr(s) for s in comp.get("steps", [])]}
+                              for comp in data["components"]]
+    if data.get("text"):
+        lines = []
+        for line in data["text"].split("\n"):
+            parts = _split_markup(line)
+            parts[1::2] = [tr(text) for text in parts[1::2]]
+            lines.append("".join(parts))
+        data["text"] = "\n".join(lines)
+    return data
+
+
+# --- TRANSLATION MEMORY ---
+
+_memory = {}  # (source, target, text) -> translation, in-process layer over the backend
+
+
+def _cache_key(source, target, text):
+    return f"cache/translations/{source}-{target}/{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+
+def localize_pattern(pattern_data, target, backend, translate_batch, source=None):
+    """
+    Translates every text field of pattern_data into `target`.
+
+    Strings are normalized and deduplicated first; terminology-only steps are
+    translated by the rule table, then the translation memory (in-process dict
+    over the storage backend) is consulted, and only the remaining novel
+    strings go to `translate_batch(texts, source, target) -> list` in one call.
+
+    Returns (new_pattern_data, stats).
+    """
+    texts = _collect(pattern_data)
+    source = source or pattern_data.get("language") or detect_language(texts)
+    stats = {"source": source, "target": target, "strings": len(texts), "unique": 0, "rules": 0, "memory": 0, "model": 0}
+    if source == target:
+        return pattern_data, stats
+
+    unique = list(dict.fromkeys(normalize_step(t) for t in texts))
+    stats["unique"] = len(unique)
+    lookup = {}
+
+    # 1. Rules
+    remaining = []
+    for text in unique:
+        translated = translate_by_rules(text, source, target)
+        if translated is not None:
+            lookup[text] = translated
+            stats["rules"] += 1
+        else:
+            remaining.append(text)
+
+    # 2. Translation memory
+    missing = []
+    for text in remaining:
+        if (source, target, text) in _memory:
+            lookup[text] = _memory[(source, target, text)]
+            stats["memory"] += 1
+        else:
+            missing.append(text)
+    if missing and backend is not None:
+        stored = backend.get_many([_cache_key(source, target, t) for t in missing])
+        still_missing = []
+        for text, value in zip(missing, stored):
+            if value is None:
+                still_missing.append(text)
+            else:
+                lookup[text] = _memory[(source, target, text)] = value.decode("utf-8")
+                stats["memory"] += 1
+        missing = still_missing
+
+    # 3. One batched model call for what is left
+    if missing:
+        translations = translate_batch(missing, source, target)
+        if len(translations) != len(missing):
+            raise ValueError(f"Expected {len(missing)} translations, got {len(translations)}")
+        for text, translated in zip(missing, translations):
+            translated = normalize_step(str(translated))
+            lookup[text] = _memory[(source, target, text)] = translated
+            if backend is not None:
+                backend.put(_cache_key(source, target, text), translated.encode("utf-8"))
+        stats["model"] = len(missing)
+
+    data = _apply(pattern_data, lookup)
+    data["language"] = target
+    return data, stats
+
+
+def build_batch_prompt(texts, source, target):
+    """Prompt asking the model to translate a JSON list of strings, keeping crochet notation."""
+    return f"""
+    Translate each string in this JSON list from {LANGUAGES.get(source, source)} to {LANGUAGES.get(target, target)}.
+    They are lines from an Amigurumi crochet pattern. Use standard crochet abbreviations of the
+    target language, keep numbers, stitch counts in parentheses and round numbers exactly as they are.
+
+    Respond with a JSON list of strings of the SAME length and order, nothing else.
+
+    {json.dumps(texts, ensure_ascii=False)}
+    """
@@ -0,0 +1,218 @@
+"""
+Local size and yarn-usage estimates for a pattern, without asking the model.
+
+The steps of every component are parsed once (memoized per pattern version)
+into per-round stitch counts, the yarn colour in use and how many copies of the
+part are made. The numbers are then computed for all rounds of all parts at
+once with NumPy, so changing yarn weight or hook size is cheap enough to redo
+on every Streamlit rerun.
+
+Model (amigurumi gauge, single crochet worked tightly):
+- stitch width  = hook + 0.4 * yarn thickness, round height = 0.92 * stitch width
+- yarn per stitch = 6 stitch widths (decreases count 1.5 stitches)
+- stuffed pieces are capsules: width = max circumference / pi, height from the
+  meridian length (rounds * round height); flat pieces are rectangles
+- 15% extra for tails and sewing
+"""
+import re
+import json
+import functools
+
+import numpy as np
+
+# name -> (yarn thickness mm, usual amigurumi hook mm)
+YARN_WEIGHTS = {
+    "Fingering (1)": (1.2, 2.25),
+    "Sport (2)": (1.6, 2.75),
+    "DK (3)": (2.0, 3.0),
+    "Worsted (4)": (2.6, 3.75),
+    "Bulky (5)": (3.6, 5.0),
+    "Super Bulky (6)": (5.0, 7.0),
+}
+DEFAULT_WEIGHT = "DK (3)"
+
+ROUND_HEIGHT_RATIO = 0.92
+YARN_PER_STITCH = 6.0
+DEC_EXTRA = 0.5
+ALLOWANCE = 1.15
+DEFAULT_COLOUR = "Main colour"
+
+# "R5:", "Rnd 5.", "R5-R12:", "Rounds 5 to 12:", "v8-v15:" (Swedish)
+_ROUND = re.compile(
+    r"^\s*(?:R(?:nds?|ounds?|ows?)?|Varv|v)\.?\s*(\d+)"
+    r"(?:\s*(?:-|–|to)\s*(?:(?:R(?:nds?|ounds?|ows?)?|Varv|v)\.?\s*)?(\d+))?\s*[:.]",
+    re.IGNORECASE)
+# Stitch count at the end of a round: "(18)", "[18]", "(59 fm)"
+_COUNT = re.compile(r"[(\[]\s*(\d+)\s*(?:[^\W\d_]+\s*)?[)\]]\s*[.!]?\s*$")
+# Rounds that are only a count: "42 fm", "6 sc in MR"
+_PLAIN_COUNT = re.compile(r"^\s*(\d+)\s*(?:sc|fm|st|sts|m|hdc|hst)\b", re.IGNORECASE)
+_DOUBLING = re.compile(r"^\s*(?:inc|2i1|öka)\b", re.IGNORECASE)
+_COLOUR = re.compile(
+    r"\b(?:with|use|using|change to|switch to|med|använd|byt till)\s+([^\W\d_][\w -]{0,30}?)\s+(?:yarn|garn)\b",
+    re.IGNORECASE)
+_CHAIN_START = re.compile(r"^\s*(?:ch\s*\d+|chain\s*\d+|lägg upp\s*\d+\s*lm|\d+\s*(?:ch|lm)\b)", re.IGNORECASE)
+_TURN = re.compile(r"\b(?:turn|vänd)\b", re.IGNORECASE)
+_COPIES = re.compile(r"(?:\(|\b)(?:x\s*(\d+)|(\d+)\s*x|make\s*(\d+)|(\d+)\s*st)\b", re.IGNORECASE)
+_HOOK = re.compile(r"(\d+(?:[.,]\d+)?)\s*mm", re.IGNORECASE)
+
+
+def colour_change(step):
+    """The yarn colour a step switches to ("Start with BLACK yarn" -> "black"), or None."""
+    found = _COLOUR.search(step)
+    return " ".join(found.group(1).split()).lower() if found else None
+
+
+def hook_from_materials(materials):
+    """Hook size in mm named in the materials list ("3.5 mm hook", "Virknål 2.5 mm"), or None."""
+    for item in materials or []:
+        if isinstance(item, str) and re.search(r"hook|nål", item, re.IGNORECASE):
+            match = _HOOK.search(item)
+            if match:
+                return float(match.group(1).replace(",", "."))
+    return None
+
+
+def components_from_text(text):
+    """Rebuilds components from a legacy markdown "text" pattern (headings start parts)."""
+    components = []
+    for line in text.split("\n"):
+        stripped = line.strip().lstrip("*-• ").strip()
+        heading = line.startswith("#") or (line.strip().startswith("**") and line.strip().endswith(("**", ":**")))
+        if heading:
+            components.append({"name": line.strip("#*: \t"), "steps": []})
+        elif stripped and components:
+            components[-1]["steps"].append(stripped)
+    return [c for c in components if any(_ROUND.match(s) for s in c["steps"])]
+
+
+# --- PARSING ---
+
+@functools.lru_cache(maxsize=64)
+def _parse(components_json):
+    """components (as JSON) -> per-round arrays plus part and colour tables. Cached per pattern version."""
+    components = json.loads(components_json)
+    counts, repeats, parts, colours = [], [], [], []
+    part_names, part_copies, part_flat = [], [], []
+    colour_names = {}
+
+    for comp in components:
+        name = comp.get("name", f"Part {len(part_names) + 1}")
+        match = _COPIES.search(name)
+        copies = int(next(g for g in match.groups() if g)) if match else 1
+        part = len(part_names)
+        colour = DEFAULT_COLOUR
+        previous = 0
+        flat = False
+        has_rounds = False
+
+        for step in comp.get("steps", []):
+            colour = colour_change(step) or colour
+            if _TURN.search(step) or (not has_rounds and _CHAIN_START.match(step)):
+                flat = True
+            round_match = _ROUND.match(step)
+            if not round_match:
+                continue
+            has_rounds = True
+            first = int(round_match.group(1))
+            last = int(round_match.group(2) or first)
+            body = step[round_match.end():]
+
+            count_match = _COUNT.search(body) or _PLAIN_COUNT.match(body)
+            if count_match:
+                count = int(count_match.group(1))
+            elif _DOUBLING.match(body) and previous:
+                count = previous * 2
+            else:
+                count = previous or 6
+
+            counts.append(count)
+            repeats.append(max(last - first + 1, 1))
+            parts.append(part)
+            colours.append(colour_names.setdefault(colour, len(colour_names)))
+            previous = count
+
+        if has_rounds:
+            part_names.append(name)
+            part_copies.append(copies)
+            part_flat.append(flat)
+
+    repeats = np.array(repeats, dtype=np.int64)
+    return {
+        "counts": np.repeat(np.array(counts, dtype=np.float64), repeats),
+        "parts": np.repeat(np.array(parts, dtype=np.int64), repeats),
+        "colours": np.repeat(np.array(colours, dtype=np.int64), repeats),
+        "part_names": part_names,
+        "part_copies": np.array(part_copies, dtype=np.float64),
+        "part_flat": np.array(part_flat, dtype=bool),
+        "colour_names": list(colour_names),
+    }
+
+
+# --- ESTIMATE ---
+
+def estimate(pattern_data, yarn_weight=DEFAULT_WEIGHT, hook_mm=None):
+    """
+    Returns {"parts": [...], "colours": [(name, metres)], "total_m", "yarn_weight", "hook_mm"},
+    or None if no rounds could be parsed. Each part is a dict with name, copies, rounds,
+    stitches, width_cm, height_cm, yarn_m (for all copies) and flat.
+    """
+    components = pattern_data.get("components")
+    if not components and pattern_data.get("text"):
+        components = components_from_text(pattern_data["text"])
+    if not components:
+        return None
+    parsed = _parse(json.dumps(components, sort_keys=True, ensure_ascii=False))
+    counts = parsed["counts"]
+    if not counts.size:
+        return None
+
+    thickness, default_hook = YARN_WEIGHTS.get(yarn_weight, YARN_WEIGHTS[DEFAULT_WEIGHT])
+    hook_mm = hook_mm or hook_from_materials(pattern_data.get("materials")) or default_hook
+    stitch_w = hook_mm + 0.4 * thickness
+    round_h = ROUND_HEIGHT_RATIO * stitch_w
+
+    parts = parsed["parts"]
+    n_parts = len(parsed["part_names"])
+    copies = parsed["part_copies"]
+
+    # Stitches worked per round: the new count plus extra yarn for every decrease
+    previous = np.empty_like(counts)
+    previous[0] = 0
+    previous[1:] = counts[:-1]
+    previous[np.r_[True, parts[1:] != parts[:-1]]] = 0
+    worked = counts + DEC_EXTRA * np.clip(previous - counts, 0, None)
+    yarn_mm = worked * (YARN_PER_STITCH * stitch_w * ALLOWANCE) * copies[parts]
+
+    rounds = np.bincount(parts, minlength=n_parts)
+    stitches = np.bincount(parts, weights=counts, minlength=n_parts)
+    part_yarn = np.bincount(parts, weights=yarn_mm, minlength=n_parts)
+    colour_yarn = np.bincount(parsed["colours"], weights=yarn_mm, minlength=len(parsed["colour_names"]))
+    widest = np.zeros(n_parts)
+    np.maximum.at(widest, parts, counts)
+
+    meridian = rounds * round_h
+    radius = widest * stitch_w / (2 * np.pi)
+    stuffed_h = np.where(meridian >= np.pi * radius, meridian - (np.pi - 2) * radius, 2 * meridian / np.pi)
+    flat = parsed["part_flat"]
+    width = np.where(flat, widest * stitch_w, 2 * radius)
+    height = np.where(flat, meridian, stuffed_h)
+
+    return {
+        "parts": [
+            {
+                "name": name,
+                "copies": int(copies[i]),
+                "rounds": int(rounds[i]),
+                "stitches": int(stitches[i]),
+                "width_cm": round(float(width[i]) / 10, 1),
+                "height_cm": round(float(height[i]) / 10, 1),
+                "yarn_m": round(float(part_yarn[i]) / 1000, 1),
+                "flat": bool(flat[i]),
+            }
+            for i, name in enumerate(parsed["part_names"])
+        ],
+        "colours": [(name, round(float(colour_yarn[i]) / 1000, 1)) for i, name in enumerate(parsed["colour_names"])],
+        "total_m": round(float(colour_yarn.sum()) / 1000, 1),
+        "yarn_weight": yarn_weight,
+        "hook_mm": hook_mm,
+    }